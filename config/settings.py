@@ -167,6 +167,62 @@ GOOGLE_DRIVE_INIT_DATA = {
 
 GOOGLE_API_CREDENTIALS_B64 = os.getenv('GOOGLE_API_CREDENTIALS_B64')
 
+GOOGLE_DRIVE_FOLDER_CACHE_TTL = int(os.getenv('GOOGLE_DRIVE_FOLDER_CACHE_TTL') or 600)
+
+# requests per second shared by the threads of a worker, 0 disables throttling
+GOOGLE_DRIVE_RATE_LIMIT = float(os.getenv('GOOGLE_DRIVE_RATE_LIMIT') or 20)
+GOOGLE_DRIVE_RATE_BURST = int(os.getenv('GOOGLE_DRIVE_RATE_BURST') or 40)
+GOOGLE_DRIVE_MAX_RETRIES = int(os.getenv('GOOGLE_DRIVE_MAX_RETRIES') or 5)
+GOOGLE_DRIVE_BACKOFF_BASE = float(os.getenv('GOOGLE_DRIVE_BACKOFF_BASE') or 1)
+GOOGLE_DRIVE_BACKOFF_MAX = float(os.getenv('GOOGLE_DRIVE_BACKOFF_MAX') or 32)
+# HTTP connections kept open per Drive client, one per concurrent request
+GOOGLE_DRIVE_HTTP_POOL_SIZE = int(os.getenv('GOOGLE_DRIVE_HTTP_POOL_SIZE') or 8)
+# access tokens are refreshed in the background this many seconds before expiry
+GOOGLE_DRIVE_TOKEN_REFRESH_MARGIN = int(os.getenv('GOOGLE_DRIVE_TOKEN_REFRESH_MARGIN') or 300)
+GOOGLE_DRIVE_TOKEN_REFRESH_RETRY = int(os.getenv('GOOGLE_DRIVE_TOKEN_REFRESH_RETRY') or 30)
+# transfer chunk size, a multiple of 256 KiB, files above the threshold are
+# uploaded over resumable sessions and downloads above the spool size go to disk
+GOOGLE_DRIVE_CHUNK_SIZE = int(os.getenv('GOOGLE_DRIVE_CHUNK_SIZE') or 8 * 1024 * 1024)
+GOOGLE_DRIVE_RESUMABLE_THRESHOLD = int(os.getenv('GOOGLE_DRIVE_RESUMABLE_THRESHOLD') or 5 * 1024 * 1024)
+GOOGLE_DRIVE_SPOOL_MAX_SIZE = int(os.getenv('GOOGLE_DRIVE_SPOOL_MAX_SIZE') or 10 * 1024 * 1024)
+GOOGLE_DRIVE_API_URL = os.getenv('GOOGLE_DRIVE_API_URL') or 'https://www.googleapis.com'
+# uploads invoices through the asyncio client, with this many requests in flight
+GOOGLE_DRIVE_ASYNC = (os.getenv('GOOGLE_DRIVE_ASYNC') or 'false').lower() == 'true'
+GOOGLE_DRIVE_ASYNC_CONCURRENCY = int(os.getenv('GOOGLE_DRIVE_ASYNC_CONCURRENCY') or 32)
+# folders and files below the root folder are mirrored in the database and
+# resolved from there, the mirror follows the Drive changes feed
+GOOGLE_DRIVE_MIRROR = (os.getenv('GOOGLE_DRIVE_MIRROR') or 'false').lower() == 'true'
+
+# 'google', or 'memory'/'disk' for the offline fake client used in load tests,
+# 'memory' is shared within a worker process only
+GOOGLE_DRIVE_BACKEND = os.getenv('GOOGLE_DRIVE_BACKEND') or 'google'
+GOOGLE_DRIVE_FAKE_ROOT = os.getenv('GOOGLE_DRIVE_FAKE_ROOT') or str(BASE_DIR / 'fake_drive')
+GOOGLE_DRIVE_FAKE_LATENCY = float(os.getenv('GOOGLE_DRIVE_FAKE_LATENCY') or 0)
+GOOGLE_DRIVE_FAKE_JITTER = float(os.getenv('GOOGLE_DRIVE_FAKE_JITTER') or 0)
+GOOGLE_DRIVE_FAKE_ERROR_RATE = float(os.getenv('GOOGLE_DRIVE_FAKE_ERROR_RATE') or 0)
+
+# render processes kept per worker, celery prefork children cannot start
+# them and render serially, the worker runs with --pool threads for that
+INVOICES_RENDER_WORKERS = int(os.getenv('INVOICES_RENDER_WORKERS') or 1)
+INVOICES_UPLOAD_WORKERS = int(os.getenv('INVOICES_UPLOAD_WORKERS') or 1)
+# both render only the templated XML parts, 'fast' also copies the other
+# members without recompressing them
+INVOICES_DOCX_RENDERER = os.getenv('INVOICES_DOCX_RENDERER') or 'docxtpl'
+INVOICES_TASK_CHUNK_SIZE = int(os.getenv('INVOICES_TASK_CHUNK_SIZE') or 10)
+INVOICES_RESTORE_CHUNK_SIZE = int(os.getenv('INVOICES_RESTORE_CHUNK_SIZE') or 100)
+INVOICES_SKIP_UNCHANGED_UPLOADS = (os.getenv('INVOICES_SKIP_UNCHANGED_UPLOADS') or 'true').lower() == 'true'
+INVOICES_INCREMENTAL_REGENERATION = (os.getenv('INVOICES_INCREMENTAL_REGENERATION') or 'true').lower() == 'true'
+
+# used by the local and ZIP outputs, which do not touch Google Drive
+INVOICES_LOCAL_TEMPLATE_PATH = os.getenv('INVOICES_LOCAL_TEMPLATE_PATH') or str(BASE_DIR / 'invoices/docx/customers.docx')
+INVOICES_LOCAL_OUTPUT_DIR = os.getenv('INVOICES_LOCAL_OUTPUT_DIR') or str(BASE_DIR / 'output')
+
+# 'drive' or 'libreoffice'
+INVOICES_PDF_CONVERTER = os.getenv('INVOICES_PDF_CONVERTER') or 'drive'
+INVOICES_PDF_CONVERTER_WORKERS = int(os.getenv('INVOICES_PDF_CONVERTER_WORKERS') or 2)
+LIBREOFFICE_BINARY = os.getenv('LIBREOFFICE_BINARY') or 'soffice'
+LIBREOFFICE_TIMEOUT = int(os.getenv('LIBREOFFICE_TIMEOUT') or 120)
+
 REDIS_PORT = os.getenv('REDIS_PORT')
 REDIS_HOST = os.getenv('REDIS_HOST')
 
@@ -180,6 +236,7 @@ CHANNEL_LAYERS = {
 }
 
 CELERY_BROKER_URL = os.getenv('REDIS_URL')
+CELERY_RESULT_BACKEND = os.getenv('REDIS_URL')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 
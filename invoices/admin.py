@@ -1,4 +1,9 @@
+import datetime
+import logging
+from collections import defaultdict
+
 from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
 from django.shortcuts import redirect
 from django.template.response import TemplateResponse
 from django.urls import path, reverse
@@ -6,7 +11,24 @@ from django.utils.html import format_html
 from django import forms
 
 from . import models
-from .tasks import generate_customer_invoices
+from .converters import find_libreoffice_pool
+from .repositories import (
+    EmployersRepository,
+    CustomersRepository,
+    WorkRepository,
+    CustomerInvoiceRepository
+)
+from .services import GenerateCustomerInvoicesService
+from .sinks import ZipSink
+from .utils import get_month_range
+from .tasks import (
+    export_customer_invoices,
+    generate_customer_invoices,
+    regenerate_customer_invoices,
+    resume_generation_run
+)
+
+logger = logging.getLogger(__name__)
 
 
 class GenerateInvoiceForm(forms.Form):
@@ -19,6 +41,17 @@ class GenerateInvoiceForm(forms.Form):
         label='Last Invoice Number',
         help_text='Enter the last invoice number to continue from.'
     )
+    output = forms.ChoiceField(
+        label='Output',
+        choices=[
+            ('drive', 'Google Drive'),
+            ('local', 'Local directory'),
+            ('zip', 'ZIP download'),
+        ],
+        initial='drive',
+        help_text='Local directory and ZIP download are previews, '
+                  'they do not touch Google Drive or the stored invoices.'
+    )
 
 @admin.register(models.Employer)
 class EmployerAdmin(admin.ModelAdmin):
@@ -39,10 +72,18 @@ class EmployerAdmin(admin.ModelAdmin):
         if request.method == 'POST':
             form = GenerateInvoiceForm(request.POST)
             if form.is_valid():
-                generate_customer_invoices.delay(
-                    month=form.cleaned_data['month'],
-                    last_invoice_number=form.cleaned_data['last_invoice_number'],
-                )
+                month = form.cleaned_data['month']
+                last_invoice_number = form.cleaned_data['last_invoice_number']
+                output = form.cleaned_data['output']
+
+                if output == 'zip':
+                    return self.stream_invoices_zip(request, month, last_invoice_number)
+
+                task = {
+                    'drive': generate_customer_invoices,
+                    'local': export_customer_invoices,
+                }[output]
+                task.delay(month=month, last_invoice_number=last_invoice_number)
 
                 messages.success(request, 'Invoices has been created.')
                 url = reverse('admin:invoices_employer_changelist')
@@ -60,6 +101,47 @@ class EmployerAdmin(admin.ModelAdmin):
         )
         return TemplateResponse(request, "admin/generate_invoice.html", context)
 
+    @staticmethod
+    def stream_invoices_zip(request, month: datetime.date, last_invoice_number: int):
+        start_date, end_date = get_month_range(month)
+        sink = ZipSink(pool=find_libreoffice_pool())
+        service = GenerateCustomerInvoicesService(
+            start_date=start_date,
+            end_date=end_date,
+            drive=None,
+            employer_repo=EmployersRepository(),
+            customer_repo=CustomersRepository(),
+            work_repo=WorkRepository(),
+            invoice_repo=CustomerInvoiceRepository(),
+            last_invoice_number=last_invoice_number,
+            sink=sink
+        )
+
+        # the query, the template and the first invoice are done before the
+        # response starts, so their errors are not sent as a truncated zip
+        invoices = service.iter_generate()
+        try:
+            first = next(invoices, None)
+        except Exception as e:
+            logger.exception('Creating the ZIP download has failed')
+            messages.error(request, f'Creating the ZIP download has failed: {e}')
+            return redirect(request.path)
+
+        def stream():
+            # every invoice is sent as soon as it is rendered
+            if first is not None:
+                yield sink.drain()
+            for _ in invoices:
+                yield sink.drain()
+            yield sink.close()
+
+        filename = f'invoices_{end_date.year}_{end_date.month:02d}.zip'
+        return StreamingHttpResponse(
+            stream(),
+            content_type='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+
     @staticmethod
     def generate_invoices(obj):
         url = reverse('admin:generate-invoices', args=[obj.id])
@@ -93,5 +175,54 @@ class WorkAdmin(admin.ModelAdmin):
 
 @admin.register(models.CustomerInvoice)
 class CustomerInvoiceAdmin(admin.ModelAdmin):
-    list_display = ['number', 'customer__name', 'created_at']
+    list_display = ['number', 'customer__name', 'year', 'month', 'created_at']
     search_fields = ['customer__name', 'created_at']
+    actions = ['regenerate_invoices']
+
+    @admin.action(description='Regenerate selected invoices')
+    def regenerate_invoices(self, request, queryset):
+        customer_ids = defaultdict(list)
+        for customer_id, year, month in queryset.values_list(
+                'customer_id', 'year', 'month'
+        ):
+            customer_ids[(year, month)].append(customer_id)
+
+        for (year, month), ids in customer_ids.items():
+            regenerate_customer_invoices.delay(
+                month=datetime.date(year, month, 1),
+                customer_ids=ids,
+            )
+
+        messages.success(
+            request,
+            f'Regenerating {sum(map(len, customer_ids.values()))} invoices.'
+        )
+
+
+class GenerationRunItemInline(admin.TabularInline):
+    model = models.GenerationRunItem
+    fields = ['customer', 'invoice_number', 'stage', 'file_id', 'updated_at']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(models.GenerationRun)
+class GenerationRunAdmin(admin.ModelAdmin):
+    list_display = ['id', 'year', 'month', 'status', 'attempt', 'created_at', 'updated_at']
+    list_filter = ['status']
+    readonly_fields = ['attempt', 'metrics']
+    inlines = [GenerationRunItemInline]
+    actions = ['resume_runs']
+
+    @admin.action(description='Resume selected runs')
+    def resume_runs(self, request, queryset):
+        runs = list(
+            queryset
+            .filter(status=models.GenerationRun.Status.RUNNING)
+            .values_list('id', 'attempt')
+        )
+        for run_id, attempt in runs:
+            resume_generation_run.delay(run_id=run_id, attempt=attempt)
+
+        messages.success(request, f'Resuming {len(runs)} runs.')
@@ -0,0 +1,403 @@
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import uuid
+from collections.abc import Coroutine
+from concurrent.futures import Future
+
+import httplib2
+import httpx
+from django.conf import settings
+from google.auth.credentials import Credentials
+from google.auth.transport.requests import Request
+from googleapiclient.errors import HttpError
+
+from .drive import (
+    FILE_FIELDS,
+    FOLDER_MIME_TYPE,
+    IDEMPOTENT_METHODS,
+    BatchResult,
+    GoogleDriveClient,
+    backoff_delay,
+    folder_cache,
+    get_connection,
+    is_retryable,
+    md5_checksum,
+    rate_limiter,
+)
+from .metrics import RunMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopThread:
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever,
+            name='drive-event-loop',
+            daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, coro: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine):
+        return self.submit(coro).result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+class AsyncGoogleDriveClient:
+
+    def __init__(
+            self,
+            credentials: Credentials | None = None,
+            metrics: RunMetrics | None = None,
+            concurrency: int | None = None,
+            base_url: str | None = None
+    ):
+        if credentials is None:
+            if not settings.GOOGLE_API_CREDENTIALS_B64:
+                raise ValueError("GOOGLE_API_CREDENTIALS_B64 is not set")
+            credentials = get_connection(settings.GOOGLE_API_CREDENTIALS_B64).credentials
+        self.credentials = credentials
+        self.metrics = metrics
+
+        concurrency = concurrency or settings.GOOGLE_DRIVE_ASYNC_CONCURRENCY
+        self.http = httpx.AsyncClient(
+            base_url=base_url or settings.GOOGLE_DRIVE_API_URL,
+            limits=httpx.Limits(max_connections=concurrency),
+            timeout=httpx.Timeout(60.0)
+        )
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._refresh_lock = asyncio.Lock()
+
+        self.root_folder_id = settings.GOOGLE_DRIVE_ROOT_FOLDER_ID
+        self.folder_cache = folder_cache
+        self.rate_limiter = rate_limiter
+
+        self.temporary_files: list[str] = []
+        self._known_files: dict[tuple[str, str], dict | None] = {}
+        self._folder_indexes: dict[str, dict[str, dict]] = {}
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def _authorize(self, headers: dict):
+        if not self.credentials.valid:
+            async with self._refresh_lock:
+                if not self.credentials.valid:
+                    await asyncio.to_thread(self.credentials.refresh, Request())
+        self.credentials.apply(headers)
+
+    async def _send(self, method_id: str, method: str, url: str, **kwargs) -> httpx.Response:
+        async with self._semaphore:
+            if self.rate_limiter.rate:
+                await asyncio.to_thread(self.rate_limiter.acquire)
+
+            headers = kwargs.pop('headers', {})
+            await self._authorize(headers)
+
+            if self.metrics is not None:
+                self.metrics.count(f'calls.{method_id}')
+                if kwargs.get('content'):
+                    self.metrics.count('drive.bytes_sent', len(kwargs['content']))
+
+            response = await self.http.request(method, url, headers=headers, **kwargs)
+
+        if response.status_code >= 400:
+            # same error type as the discovery based client, so callers and
+            # retries handle both alike
+            raise HttpError(
+                resp=httplib2.Response({'status': response.status_code, **response.headers}),
+                content=response.content,
+                uri=str(response.url)
+            )
+        if self.metrics is not None and not response.headers.get('content-type', '').startswith('application/json'):
+            self.metrics.count('drive.bytes_received', len(response.content))
+        return response
+
+    async def _request(self, method_id: str, method: str, url: str, **kwargs) -> httpx.Response:
+        for attempt in itertools.count():
+            try:
+                return await self._send(method_id, method, url, **kwargs)
+            except (HttpError, httpx.TransportError) as e:
+                idempotent = method in IDEMPOTENT_METHODS
+                if isinstance(e, httpx.TransportError):
+                    # nothing reached Drive when the connection was not made
+                    retryable = idempotent or isinstance(e, httpx.ConnectError)
+                else:
+                    retryable = is_retryable(e, idempotent)
+                if attempt >= settings.GOOGLE_DRIVE_MAX_RETRIES or not retryable:
+                    raise
+
+                delay = backoff_delay(attempt, e)
+                if self.metrics is not None:
+                    self.metrics.count('drive.retries')
+                logger.warning(f'Drive request failed ({e}), retrying in {delay:.2f}s')
+                await asyncio.sleep(delay)
+
+    async def _json(self, method_id: str, method: str, url: str, **kwargs) -> dict:
+        response = await self._request(method_id, method, url, **kwargs)
+        return response.json() if response.content else {}
+
+    async def download(self, file_id: str) -> bytes:
+        response = await self._request(
+            'drive.files.get',
+            'GET',
+            f'/drive/v3/files/{file_id}',
+            params={'alt': 'media'}
+        )
+        logger.debug(f'File {file_id} downloaded successfully.')
+        return response.content
+
+    async def get_md5_checksum(self, file_id: str) -> str:
+        file = await self._json(
+            'drive.files.get',
+            'GET',
+            f'/drive/v3/files/{file_id}',
+            params={'fields': 'md5Checksum'}
+        )
+        return file.get('md5Checksum')
+
+    async def _list(self, query: str, fields: str, page_token: str | None = None) -> dict:
+        params = {'q': query, 'fields': fields, 'pageSize': 1000}
+        if page_token:
+            params['pageToken'] = page_token
+        return await self._json('drive.files.list', 'GET', '/drive/v3/files', params=params)
+
+    async def index_folder(self, folder_id: str) -> dict[str, dict]:
+        query = (
+            f"'{folder_id}' in parents "
+            f"and mimeType != '{FOLDER_MIME_TYPE}' and trashed = false"
+        )
+
+        index = {}
+        page_token = None
+        while True:
+            results = await self._list(
+                query,
+                fields=f'nextPageToken, files({FILE_FIELDS})',
+                page_token=page_token
+            )
+            for file in results.get('files', []):
+                index.setdefault(file['name'], file)
+
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        self._folder_indexes[folder_id] = index
+        return index
+
+    def _remember_file(self, parent_id: str, file: dict):
+        self._known_files[(parent_id, file['name'])] = file
+        if parent_id in self._folder_indexes:
+            self._folder_indexes[parent_id][file['name']] = file
+
+    async def _get_file(self, filename: str, parent_id: str) -> dict | None:
+        if parent_id in self._folder_indexes:
+            return self._folder_indexes[parent_id].get(filename)
+
+        if (parent_id, filename) in self._known_files:
+            return self._known_files[(parent_id, filename)]
+
+        results = await self._list(
+            GoogleDriveClient._file_query(filename, parent_id),
+            fields=f'files({FILE_FIELDS})'
+        )
+        files = results.get('files', [])
+        return files[0] if files else None
+
+    async def _upload_media(
+            self,
+            content: bytes,
+            mimetype: str,
+            metadata: dict,
+            file_id: str | None = None
+    ) -> dict:
+        boundary = uuid.uuid4().hex
+        body = b''.join([
+            f'--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n'.encode(),
+            json.dumps(metadata).encode(),
+            f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n\r\n'.encode(),
+            content,
+            f'\r\n--{boundary}--'.encode(),
+        ])
+
+        url = '/upload/drive/v3/files'
+        if file_id:
+            url += f'/{file_id}'
+        return await self._json(
+            'drive.files.update' if file_id else 'drive.files.create',
+            'PATCH' if file_id else 'POST',
+            url,
+            params={'uploadType': 'multipart', 'fields': FILE_FIELDS},
+            headers={'Content-Type': f'multipart/related; boundary={boundary}'},
+            content=body
+        )
+
+    async def upload(
+            self,
+            filename: str,
+            content: bytes,
+            parent_id: str,
+            mimetype: str = 'application/octet-stream',
+            app_properties: dict | None = None
+    ) -> str:
+        file = await self._get_file(filename=filename, parent_id=parent_id)
+
+        if file:
+            file = await self._upload_media(
+                content=content,
+                mimetype=mimetype,
+                metadata={'appProperties': app_properties} if app_properties else {},
+                file_id=file['id']
+            )
+            logger.debug(f'File {filename} updated successfully. (UPDATED)')
+        else:
+            metadata = {'name': filename, 'parents': [parent_id]}
+            if app_properties:
+                metadata['appProperties'] = app_properties
+            try:
+                file = await self._upload_media(
+                    content=content,
+                    mimetype=mimetype,
+                    metadata=metadata
+                )
+            except HttpError as e:
+                self._invalidate_missing_folder(e, parent_id)
+                raise
+            logger.debug(f'File {filename} uploaded successfully. (CREATED)')
+
+        self._remember_file(parent_id, file)
+        return file['id']
+
+    async def upload_if_changed(
+            self,
+            filename: str,
+            content: bytes,
+            parent_id: str,
+            mimetype: str = 'application/octet-stream'
+    ) -> tuple[str, bool]:
+        existing = await self._get_file(filename=filename, parent_id=parent_id)
+        if existing and existing.get('md5Checksum') == md5_checksum(content):
+            logger.debug(f'File {filename} is up to date. (SKIPPED)')
+            return existing['id'], False
+
+        file_id = await self.upload(
+            filename=filename,
+            content=content,
+            parent_id=parent_id,
+            mimetype=mimetype
+        )
+        return file_id, True
+
+    async def is_converted(self, pdf_name: str, parent_id: str, source_md5: str) -> bool:
+        existing = await self._get_file(filename=pdf_name, parent_id=parent_id)
+        if not existing:
+            return False
+        return existing.get('appProperties', {}).get('source_md5') == source_md5
+
+    async def create_folder_structure(self, name: str) -> str:
+        path_parts = name.strip('/').split('/')
+
+        parent_id = self.root_folder_id
+        for depth, folder_name in enumerate(path_parts, start=1):
+            path = '/'.join(path_parts[:depth])
+            folder_id = self.folder_cache.get(self.root_folder_id, path)
+            if folder_id is None:
+                folder_id = await self._get_or_create_folder(folder_name, parent_id)
+                self.folder_cache.set(self.root_folder_id, path, folder_id)
+            parent_id = folder_id
+
+        return parent_id
+
+    def _invalidate_missing_folder(self, error: HttpError, folder_id: str):
+        if error.resp.status == 404:
+            self.folder_cache.invalidate(folder_id)
+
+    async def _get_or_create_folder(self, folder_name: str, parent_id: str) -> str:
+        query = (
+            f"name = '{folder_name}' and mimeType = '{FOLDER_MIME_TYPE}' "
+            f"and '{parent_id}' in parents and trashed = false"
+        )
+        results = await self._list(query, fields='files(id, name)')
+        files = results.get('files', [])
+        if files:
+            return files[0]['id']
+
+        try:
+            folder = await self._json(
+                'drive.files.create',
+                'POST',
+                '/drive/v3/files',
+                params={'fields': 'id'},
+                json={'name': folder_name, 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent_id]}
+            )
+        except HttpError as e:
+            self._invalidate_missing_folder(e, parent_id)
+            raise
+        return folder['id']
+
+    async def convert_docx_to_pdf(
+            self,
+            file_id: str,
+            filename: str,
+            folder_id: str,
+            cleanup: bool = True,
+            app_properties: dict | None = None
+    ) -> str:
+        copied_file = await self._json(
+            'drive.files.copy',
+            'POST',
+            f'/drive/v3/files/{file_id}/copy',
+            json={'mimeType': 'application/vnd.google-apps.document'}
+        )
+        copied_file_id = copied_file['id']
+
+        response = await self._request(
+            'drive.files.export',
+            'GET',
+            f'/drive/v3/files/{copied_file_id}/export',
+            params={'mimeType': 'application/pdf'}
+        )
+        pdf_id = await self.upload(
+            filename=filename.replace('.docx', '.pdf'),
+            content=response.content,
+            parent_id=folder_id,
+            mimetype='application/pdf',
+            app_properties=app_properties
+        )
+
+        logger.debug(f'Converted {filename} to PDF and saved to destination folder')
+        if cleanup:
+            await self._request('drive.files.delete', 'DELETE', f'/drive/v3/files/{copied_file_id}')
+        else:
+            # removed in bulk by cleanup_temporary_files
+            self.temporary_files.append(copied_file_id)
+
+        return pdf_id
+
+    async def delete_files(self, file_ids: list[str]) -> dict[str, BatchResult]:
+        async def delete(file_id: str) -> BatchResult:
+            try:
+                await self._request('drive.files.delete', 'DELETE', f'/drive/v3/files/{file_id}')
+            except HttpError as e:
+                return BatchResult(key=file_id, error=e)
+            return BatchResult(key=file_id, response={})
+
+        results = await asyncio.gather(*(delete(file_id) for file_id in file_ids))
+        return {result.key: result for result in results}
+
+    async def cleanup_temporary_files(self) -> dict[str, BatchResult]:
+        file_ids, self.temporary_files = self.temporary_files, []
+        return await self.delete_files(file_ids)
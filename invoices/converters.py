@@ -0,0 +1,213 @@
+import atexit
+import io
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .drive import GoogleDriveClient, BatchResult, md5_checksum
+
+logger = logging.getLogger(__name__)
+
+
+class PdfConverter:
+
+    def convert(
+            self,
+            file_id: str,
+            filename: str,
+            content: bytes,
+            folder_id: str
+    ) -> str:
+        raise NotImplementedError
+
+    def finish(self) -> dict[str, BatchResult]:
+        return {}
+
+    @staticmethod
+    def create_pdf_filename(filename: str) -> str:
+        return filename.replace('.docx', '.pdf')
+
+    @staticmethod
+    def create_app_properties(content: bytes) -> dict:
+        # lets reruns tell whether the PDF was made from the current DOCX
+        return {'source_md5': md5_checksum(content)}
+
+
+class DrivePdfConverter(PdfConverter):
+
+    def __init__(self, drive: GoogleDriveClient):
+        self.drive = drive
+
+    def convert(
+            self,
+            file_id: str,
+            filename: str,
+            content: bytes,
+            folder_id: str
+    ) -> str:
+        return self.drive.convert_docx_to_pdf(
+            file_id=file_id,
+            filename=filename,
+            folder_id=folder_id,
+            cleanup=False,
+            app_properties=self.create_app_properties(content)
+        )
+
+    def finish(self) -> dict[str, BatchResult]:
+        return self.drive.cleanup_temporary_files()
+
+
+class LibreOfficePool:
+
+    def __init__(self, binary: str, workers: int = 1, timeout: int = 120):
+        self.binary = binary
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='soffice'
+        )
+        # concurrent soffice processes have to use separate user profiles,
+        # otherwise they wait on each other's profile lock
+        self._profile_dirs = [
+            tempfile.mkdtemp(prefix='soffice-profile-') for _ in range(workers)
+        ]
+        self._profiles = queue.SimpleQueue()
+        for profile in self._profile_dirs:
+            self._profiles.put(profile)
+
+        self._pid = os.getpid()
+        atexit.register(self.close)
+
+    def close(self):
+        # forked children inherit the pool but not the ownership of its profiles
+        if os.getpid() != self._pid:
+            return
+        self._executor.shutdown(cancel_futures=True)
+        for profile in self._profile_dirs:
+            shutil.rmtree(profile, ignore_errors=True)
+        self._profile_dirs = []
+
+    def convert(self, content: bytes) -> bytes:
+        return self._executor.submit(self._convert, content).result()
+
+    def _convert(self, content: bytes) -> bytes:
+        profile = self._profiles.get()
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                source = os.path.join(tmp_dir, 'document.docx')
+                with open(source, 'wb') as file:
+                    file.write(content)
+
+                subprocess.run(
+                    [
+                        self.binary,
+                        f'-env:UserInstallation=file://{profile}',
+                        '--headless',
+                        '--norestore',
+                        '--convert-to', 'pdf',
+                        '--outdir', tmp_dir,
+                        source
+                    ],
+                    check=True,
+                    capture_output=True,
+                    timeout=self.timeout
+                )
+
+                with open(os.path.join(tmp_dir, 'document.pdf'), 'rb') as file:
+                    return file.read()
+        finally:
+            self._profiles.put(profile)
+
+
+_libreoffice_pool: LibreOfficePool | None = None
+_libreoffice_pool_lock = threading.Lock()
+
+
+def get_libreoffice_pool() -> LibreOfficePool:
+    global _libreoffice_pool
+    with _libreoffice_pool_lock:
+        if _libreoffice_pool is None:
+            _libreoffice_pool = LibreOfficePool(
+                binary=settings.LIBREOFFICE_BINARY,
+                workers=settings.INVOICES_PDF_CONVERTER_WORKERS,
+                timeout=settings.LIBREOFFICE_TIMEOUT
+            )
+        return _libreoffice_pool
+
+
+def find_libreoffice_pool() -> LibreOfficePool | None:
+    if shutil.which(settings.LIBREOFFICE_BINARY):
+        return get_libreoffice_pool()
+    logger.warning(f'{settings.LIBREOFFICE_BINARY} not found, skipping PDFs')
+    return None
+
+
+class LibreOfficePdfConverter(PdfConverter):
+
+    def __init__(
+            self,
+            drive: GoogleDriveClient,
+            pool: LibreOfficePool,
+            fallback: PdfConverter | None = None
+    ):
+        self.drive = drive
+        self.pool = pool
+        self.fallback = fallback
+
+    def convert(
+            self,
+            file_id: str,
+            filename: str,
+            content: bytes,
+            folder_id: str
+    ) -> str:
+        try:
+            pdf_content = self.pool.convert(content)
+        except (OSError, subprocess.SubprocessError) as e:
+            if self.fallback is None:
+                raise
+            logger.warning(f'LibreOffice failed to convert {filename}, falling back: {e}')
+            return self.fallback.convert(
+                file_id=file_id,
+                filename=filename,
+                content=content,
+                folder_id=folder_id
+            )
+
+        with io.BytesIO(pdf_content) as buffer:
+            return self.drive.upload(
+                filename=self.create_pdf_filename(filename),
+                file=buffer,
+                parent_id=folder_id,
+                mimetype='application/pdf',
+                app_properties=self.create_app_properties(content)
+            )
+
+    def finish(self) -> dict[str, BatchResult]:
+        if self.fallback is None:
+            return {}
+        return self.fallback.finish()
+
+
+def get_pdf_converter(drive: GoogleDriveClient) -> PdfConverter:
+    converter = DrivePdfConverter(drive)
+
+    if settings.INVOICES_PDF_CONVERTER == 'libreoffice':
+        if shutil.which(settings.LIBREOFFICE_BINARY):
+            return LibreOfficePdfConverter(
+                drive=drive,
+                pool=get_libreoffice_pool(),
+                fallback=converter
+            )
+        logger.warning(
+            f'{settings.LIBREOFFICE_BINARY} not found, converting PDFs on Google Drive'
+        )
+
+    return converter
@@ -1,127 +1,765 @@
 import base64
+import contextlib
+import dataclasses
+import datetime
+import functools
+import hashlib
 import io
+import itertools
 import json
+import logging
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator
+from typing import IO
 
 from django.conf import settings
 
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
-
+from google_auth_httplib2 import AuthorizedHttp, Request
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import (
+    HttpRequest,
+    MediaIoBaseDownload,
+    MediaIoBaseUpload,
+    build_http
+)
+
+from .metrics import RunMetrics
+from .repositories import DriveFileRepository
+
+logger = logging.getLogger(__name__)
 
 SCOPES = settings.GOOGLE_DRIVE_SCOPES
 GOOGLE_API_CREDENTIALS_B64 = settings.GOOGLE_API_CREDENTIALS_B64
 ROOT_FOLDER_ID = settings.GOOGLE_DRIVE_ROOT_FOLDER_ID
 
+# Drive rejects batches with more than 100 calls
+BATCH_SIZE = 100
+
+FILE_FIELDS = 'id, name, md5Checksum, appProperties'
+MIRROR_FIELDS = f'{FILE_FIELDS}, mimeType, parents'
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# a POST that failed may still have created its file, only these methods are
+# sent again after errors that do not prove the request was rejected
+IDEMPOTENT_METHODS = {'GET', 'PATCH', 'DELETE'}
+RATE_LIMIT_REASONS = {'userRateLimitExceeded', 'rateLimitExceeded'}
+
+
+@dataclasses.dataclass
+class BatchResult:
+    key: str
+    response: dict | None = None
+    error: HttpError | None = None
+
+
+def md5_checksum(content: bytes) -> str:
+    return hashlib.md5(content).hexdigest()
+
+
+def md5_checksum_file(file: IO[bytes]) -> str:
+    checksum = hashlib.md5()
+    file.seek(0)
+    while chunk := file.read(1024 * 1024):
+        checksum.update(chunk)
+    file.seek(0)
+    return checksum.hexdigest()
+
+
+class FolderCache:
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._folders: dict[tuple[str, str], tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, root_id: str, path: str) -> str | None:
+        with self._lock:
+            cached = self._folders.get((root_id, path))
+            if cached is None:
+                return None
+
+            folder_id, expires_at = cached
+            if expires_at < time.monotonic():
+                del self._folders[(root_id, path)]
+                return None
+            return folder_id
+
+    def set(self, root_id: str, path: str, folder_id: str):
+        with self._lock:
+            self._folders[(root_id, path)] = (folder_id, time.monotonic() + self.ttl)
+
+    def invalidate(self, folder_id: str):
+        with self._lock:
+            missing = {
+                key for key, (cached_id, _) in self._folders.items()
+                if cached_id == folder_id
+            }
+            # subfolders of a missing folder are gone as well
+            for key in list(self._folders):
+                root_id, path = key
+                if key in missing or any(
+                    root_id == missing_root_id and path.startswith(f'{missing_path}/')
+                    for missing_root_id, missing_path in missing
+                ):
+                    del self._folders[key]
+
+    def clear(self):
+        with self._lock:
+            self._folders.clear()
+
+
+folder_cache = FolderCache(ttl=settings.GOOGLE_DRIVE_FOLDER_CACHE_TTL)
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1):
+        if not self.rate:
+            return
+
+        while tokens > 0:
+            # larger requests, like batches, take the bucket in several rounds
+            needed = min(tokens, self.capacity)
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+
+                if self._tokens >= needed:
+                    self._tokens -= needed
+                    tokens -= needed
+                    continue
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+rate_limiter = TokenBucket(
+    rate=settings.GOOGLE_DRIVE_RATE_LIMIT,
+    capacity=settings.GOOGLE_DRIVE_RATE_BURST
+)
+
+
+def is_retryable(error: Exception, idempotent: bool = True) -> bool:
+    if not isinstance(error, HttpError):
+        if isinstance(error, ConnectionRefusedError):
+            return True
+        return idempotent and isinstance(error, (ConnectionError, TimeoutError))
+
+    if error.resp.status == 403:
+        details = getattr(error, 'error_details', None)
+        return isinstance(details, list) and any(
+            isinstance(detail, dict) and detail.get('reason') in RATE_LIMIT_REASONS
+            for detail in details
+        )
+    if not idempotent:
+        return error.resp.status == 429
+    return error.resp.status in RETRYABLE_STATUSES
+
+
+def backoff_delay(attempt: int, error: Exception | None = None) -> float:
+    # full jitter, so throttled workers do not retry in lockstep
+    delay = random.uniform(
+        0,
+        min(settings.GOOGLE_DRIVE_BACKOFF_MAX, settings.GOOGLE_DRIVE_BACKOFF_BASE * 2 ** attempt)
+    )
+    if isinstance(error, HttpError):
+        retry_after = error.resp.get('retry-after')
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+    return delay
+
+
+def call_with_retries(
+        func: Callable,
+        metrics: RunMetrics | None = None,
+        max_retries: int | None = None,
+        idempotent: bool = True
+):
+    if max_retries is None:
+        max_retries = settings.GOOGLE_DRIVE_MAX_RETRIES
+
+    for attempt in itertools.count():
+        try:
+            return func()
+        except (HttpError, ConnectionError, TimeoutError) as e:
+            if attempt >= max_retries or not is_retryable(e, idempotent):
+                raise
+
+            delay = backoff_delay(attempt, e)
+            if metrics is not None:
+                metrics.count('drive.retries')
+            logger.warning(f'Drive request failed ({e}), retrying in {delay:.2f}s')
+            time.sleep(delay)
+
+
+class HttpPool:
+
+    def __init__(self, credentials, size: int):
+        self.credentials = credentials
+        self.size = size
+        self._created = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def lease(self):
+        # httplib2 connections are not thread-safe, each thread borrows its own
+        # and returns it with the keep-alive connection still open
+        try:
+            http = self._idle.get_nowait()
+        except queue.Empty:
+            http = self._create() or self._idle.get()
+        try:
+            yield http
+        finally:
+            self._idle.put(http)
 
-class GoogleDriveClient:
+    def _create(self) -> AuthorizedHttp | None:
+        with self._lock:
+            if self._created >= self.size:
+                return None
+            self._created += 1
+        return AuthorizedHttp(self.credentials, http=build_http())
 
-    def __init__(self, credentials: str = GOOGLE_API_CREDENTIALS_B64):
-        if not credentials:
-            raise ValueError("GOOGLE_API_CREDENTIALS_B64 is not set")
 
-        credentials_info = self.decode_credentials(credentials)
+@functools.cache
+def load_discovery_document() -> dict:
+    # bundled with google-api-python-client, parsed once per process
+    document = json.loads(discovery_cache.get_static_doc('drive', 'v3'))
+
+    # resources fill in their method parameters in place on first use, so
+    # they are built once here and later clients share a settled document
+    service = build_from_document(document, http=build_http())
+    for name in document['resources']:
+        getattr(service, name)()
+    return document
+
+
+def decode_credentials(credentials_b64: str) -> dict:
+    try:
+        credentials_json = base64.b64decode(credentials_b64).decode('utf-8')
+        credentials = json.loads(credentials_json)
+        return credentials
+    except Exception as e:
+        raise ValueError(f"Failed to decode credentials: {e}")
+
+
+class DriveConnection:
+
+    def __init__(self, credentials_b64: str):
         self.credentials = service_account.Credentials.from_service_account_info(
-            credentials_info,
+            decode_credentials(credentials_b64),
             scopes=SCOPES
         )
-        self.service = build('drive', 'v3', credentials=self.credentials)
-        self.root_folder_id = ROOT_FOLDER_ID
+        self.http_pool = HttpPool(
+            credentials=self.credentials,
+            size=settings.GOOGLE_DRIVE_HTTP_POOL_SIZE
+        )
+        self.pid = os.getpid()
 
-    @staticmethod
-    def decode_credentials(credentials_b64: str) -> str:
-        try:
-            credentials_json = base64.b64decode(credentials_b64).decode('utf-8')
-            credentials = json.loads(credentials_json)
-            return credentials
-        except Exception as e:
-            raise ValueError(f"Failed to decode credentials: {e}")
+        self._refresher = threading.Thread(
+            target=self._refresh_credentials,
+            name='drive-credentials',
+            daemon=True
+        )
+        self._refresher.start()
+
+    def _refresh_credentials(self):
+        # keeps a valid token around, so requests never wait on a refresh
+        request = Request(build_http())
+        while True:
+            try:
+                self.credentials.refresh(request)
+                delay = self._seconds_until_refresh()
+            except Exception as e:
+                delay = settings.GOOGLE_DRIVE_TOKEN_REFRESH_RETRY
+                logger.warning(f'Failed to refresh Drive credentials, retrying in {delay}s: {e}')
+            time.sleep(delay)
+
+    def _seconds_until_refresh(self) -> float:
+        if self.credentials.expiry is None:
+            return settings.GOOGLE_DRIVE_TOKEN_REFRESH_RETRY
+
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        remaining = (self.credentials.expiry - now).total_seconds()
+        return max(remaining - settings.GOOGLE_DRIVE_TOKEN_REFRESH_MARGIN, 1)
+
+
+_connections: dict[str, DriveConnection] = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(credentials_b64: str) -> DriveConnection:
+    with _connections_lock:
+        connection = _connections.get(credentials_b64)
+        # forked workers start their own transports and refresh thread
+        if connection is None or connection.pid != os.getpid():
+            connection = _connections[credentials_b64] = DriveConnection(credentials_b64)
+        return connection
+
+
+class MeteredHttpRequest(HttpRequest):
+
+    def __init__(self, client: 'GoogleDriveClient', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = client
+
+    def execute(self, http=None, num_retries=0):
+        def execute():
+            self.client.rate_limiter.acquire()
+            self.client.record_request(self)
+            if http is not None:
+                return super(MeteredHttpRequest, self).execute(http=http, num_retries=num_retries)
+            with self.client.http_pool.lease() as leased_http:
+                return super(MeteredHttpRequest, self).execute(
+                    http=leased_http,
+                    num_retries=num_retries
+                )
+
+        response = call_with_retries(
+            execute,
+            metrics=self.client.metrics,
+            idempotent=self.method.upper() in IDEMPOTENT_METHODS
+        )
+        if isinstance(response, bytes) and self.client.metrics is not None:
+            self.client.metrics.count('drive.bytes_received', len(response))
+        return response
+
+
+class GoogleDriveClient:
+
+    def __init__(
+            self,
+            credentials: str = GOOGLE_API_CREDENTIALS_B64,
+            metrics: RunMetrics | None = None,
+            mirror: DriveFileRepository | None = None
+    ):
+        if not credentials:
+            raise ValueError("GOOGLE_API_CREDENTIALS_B64 is not set")
 
-    def download(self, file_id: str) -> io.BytesIO:
+        # credentials and open connections are shared by the clients of a
+        # process, the client itself only keeps the state of one run
+        connection = get_connection(credentials)
+        self.credentials = connection.credentials
+        self.metrics = metrics
+        self.http_pool = connection.http_pool
+        self.service = build_from_document(
+            load_discovery_document(),
+            credentials=self.credentials,
+            requestBuilder=self._build_request
+        )
+        self.root_folder_id = ROOT_FOLDER_ID
+        self.folder_cache = folder_cache
+        self.rate_limiter = rate_limiter
+        self.mirror = mirror
+
+        self.temporary_files: list[str] = []
+        self._known_files: dict[tuple[str, str], dict] = {}
+        self._folder_indexes: dict[str, dict[str, dict]] = {}
+        self._mirror_synced: bool | None = None
+        self._mirror_lock = threading.Lock()
+        self._mirror_upserts: dict[str, dict] = {}
+        self._mirror_deletes: set[str] = set()
+
+    def _build_request(self, *args, **kwargs) -> MeteredHttpRequest:
+        return MeteredHttpRequest(self, *args, **kwargs)
+
+    def record_request(self, request: HttpRequest):
+        if self.metrics is None:
+            return
+        self.metrics.count(f'calls.{request.methodId}')
+        if request.body:
+            self.metrics.count('drive.bytes_sent', len(request.body))
+        # a retried resumable upload continues its session, count it once
+        if request.resumable is not None and not request.resumable_progress:
+            self.metrics.count('drive.bytes_sent', request.resumable.size())
+
+    def download(self, file_id: str) -> IO[bytes]:
         request = self.service.files().get_media(fileId=file_id)
+        self.record_request(request)
+
+        # large files are spooled to disk instead of staying in worker memory
+        buffer = tempfile.SpooledTemporaryFile(max_size=settings.GOOGLE_DRIVE_SPOOL_MAX_SIZE)
+        with self.http_pool.lease() as http:
+            request.http = http
+            downloader = MediaIoBaseDownload(
+                buffer,
+                request,
+                chunksize=settings.GOOGLE_DRIVE_CHUNK_SIZE
+            )
+
+            def next_chunk():
+                self.rate_limiter.acquire()
+                return downloader.next_chunk()
 
-        buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(buffer, request)
+            done = False
+            while not done:
+                # a failed chunk is requested again from the last byte received
+                status, done = call_with_retries(next_chunk, metrics=self.metrics)
+                logger.debug(f'Download {file_id} {int(status.progress() * 100)}%')
 
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            print(f"  Download {int(status.progress() * 100)}%")
+        if self.metrics is not None:
+            self.metrics.count('drive.bytes_received', buffer.tell())
 
         buffer.seek(0)
-        print(f"File {file_id} downloaded successfully.")
+        logger.debug(f'File {file_id} downloaded successfully.')
         return buffer
 
-    def _get_file(self, filename: str, parent_id: str) -> dict:
+    def get_md5_checksum(self, file_id: str) -> str:
+        file = self.service.files().get(fileId=file_id, fields='md5Checksum').execute()
+        return file.get('md5Checksum')
+
+    def execute_batch(self, requests: dict[str, HttpRequest]) -> dict[str, BatchResult]:
+        keys = list(requests)
+        results = {}
+
+        def callback(request_id, response, exception):
+            key = keys[int(request_id)]
+            results[key] = BatchResult(key=key, response=response, error=exception)
+
+        def execute(batch_indexes: list[int]):
+            batch = self.service.new_batch_http_request(callback=callback)
+            for index in batch_indexes:
+                self.record_request(requests[keys[index]])
+                batch.add(requests[keys[index]], request_id=str(index))
+            if self.metrics is not None:
+                self.metrics.count('drive.batches')
+            # every call in a batch counts against the quota
+            self.rate_limiter.acquire(len(batch_indexes))
+            with self.http_pool.lease() as http:
+                batch.execute(http=http)
+
+        indexes = list(range(len(keys)))
+        for attempt in itertools.count():
+            for start in range(0, len(indexes), BATCH_SIZE):
+                batch_indexes = indexes[start:start + BATCH_SIZE]
+                call_with_retries(
+                    lambda: execute(batch_indexes),
+                    metrics=self.metrics,
+                    idempotent=all(
+                        requests[keys[index]].method.upper() in IDEMPOTENT_METHODS
+                        for index in batch_indexes
+                    )
+                )
+
+            # throttled calls are sent again, other errors are left to the caller
+            indexes = [
+                index for index in indexes
+                if results[keys[index]].error is not None
+                and is_retryable(
+                    results[keys[index]].error,
+                    requests[keys[index]].method.upper() in IDEMPOTENT_METHODS
+                )
+            ]
+            if not indexes or attempt >= settings.GOOGLE_DRIVE_MAX_RETRIES:
+                break
+
+            delay = backoff_delay(attempt)
+            if self.metrics is not None:
+                self.metrics.count('drive.retries', len(indexes))
+            logger.warning(f'{len(indexes)} batched Drive calls failed, retrying in {delay:.2f}s')
+            time.sleep(delay)
+
+        return results
+
+    def delete_files(self, file_ids: list[str]) -> dict[str, BatchResult]:
+        results = self.execute_batch({
+            file_id: self.service.files().delete(fileId=file_id)
+            for file_id in file_ids
+        })
+        self._unmirror_files([
+            file_id for file_id, result in results.items() if result.error is None
+        ])
+        return results
+
+    def cleanup_temporary_files(self) -> dict[str, BatchResult]:
+        file_ids, self.temporary_files = self.temporary_files, []
+        return self.delete_files(file_ids)
+
+    @staticmethod
+    def _file_query(filename: str, parent_id: str) -> str:
+        filename = filename.replace("\\", "\\\\").replace("'", "\\'")
         query = f"name = '{filename}' and mimeType != 'application/vnd.google-apps.folder' and trashed = false"
         if parent_id:
             query += f" and '{parent_id}' in parents"
+        return query
+
+    def _list_files(self, query: str, fields: str = FILE_FIELDS) -> Iterator[dict]:
+        page_token = None
+        while True:
+            results = self.service.files().list(
+                q=query,
+                fields=f'nextPageToken, files({fields})',
+                pageSize=1000,
+                pageToken=page_token
+            ).execute()
+            yield from results.get('files', [])
+
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+    def list_folder(self, folder_id: str) -> list[dict]:
+        return list(self._list_files(
+            query=f"'{folder_id}' in parents and trashed = false",
+            fields=MIRROR_FIELDS
+        ))
+
+    def get_start_page_token(self) -> str:
+        return self.service.changes().getStartPageToken().execute()['startPageToken']
+
+    def list_changes(self, page_token: str) -> dict:
+        return self.service.changes().list(
+            pageToken=page_token,
+            spaces='drive',
+            includeRemoved=True,
+            pageSize=1000,
+            fields=(
+                f'nextPageToken, newStartPageToken, '
+                f'changes(fileId, removed, file({MIRROR_FIELDS}, trashed))'
+            )
+        ).execute()
+
+    def is_mirror_synced(self) -> bool:
+        if self.mirror is None:
+            return False
+        if self._mirror_synced is None:
+            self._mirror_synced = self.mirror.is_synced(self.root_folder_id)
+        return self._mirror_synced
+
+    def _mirror_files(self, parent_id: str, files: list[dict], mimetype: str = ''):
+        # uploads run on worker threads, the rows are written by flush_mirror
+        if self.mirror is None:
+            return
+        with self._mirror_lock:
+            for file in files:
+                self._mirror_deletes.discard(file['id'])
+                self._mirror_upserts[file['id']] = {
+                    'mimeType': mimetype,
+                    **file,
+                    'parents': [parent_id]
+                }
+
+    def _unmirror_files(self, file_ids: list[str]):
+        if self.mirror is None:
+            return
+        with self._mirror_lock:
+            for file_id in file_ids:
+                self._mirror_upserts.pop(file_id, None)
+                self._mirror_deletes.add(file_id)
+
+    def flush_mirror(self):
+        # called from the thread that owns the database connection
+        if self.mirror is None:
+            return
+        with self._mirror_lock:
+            upserts, self._mirror_upserts = self._mirror_upserts, {}
+            deletes, self._mirror_deletes = self._mirror_deletes, set()
+        if deletes:
+            self.mirror.delete_many(list(deletes))
+        if upserts:
+            self.mirror.upsert_many(list(upserts.values()))
+
+    def index_folder(self, folder_id: str) -> dict[str, dict]:
+        if self.is_mirror_synced():
+            # the mirror is kept current by the changes feed and our own writes
+            index = self.mirror.get_children(folder_id)
+        else:
+            index = {}
+            files = list(self._list_files(
+                f"'{folder_id}' in parents "
+                f"and mimeType != '{FOLDER_MIME_TYPE}' and trashed = false"
+            ))
+            for file in files:
+                index.setdefault(file['name'], file)
+            self._mirror_files(folder_id, files)
+
+        self._folder_indexes[folder_id] = index
+        return index
+
+    def _remember_file(self, parent_id: str, file: dict):
+        self._known_files[(parent_id, file['name'])] = file
+        if parent_id in self._folder_indexes:
+            self._folder_indexes[parent_id][file['name']] = file
+        self._mirror_files(parent_id, [file])
+
+    def _get_file(self, filename: str, parent_id: str) -> dict:
+        if parent_id in self._folder_indexes:
+            return self._folder_indexes[parent_id].get(filename)
 
-        results = self.service.files().list(q=query, fields="files(id, name)").execute()
+        if (parent_id, filename) in self._known_files:
+            return self._known_files[(parent_id, filename)]
+
+        query = self._file_query(filename, parent_id)
+        results = self.service.files().list(q=query, fields=f"files({FILE_FIELDS})").execute()
         files = results.get('files', [])
         return files[0] if files else None
 
-    def _update_file(self, file_id: str, media: MediaIoBaseUpload) -> str:
-        self.service.files().update(
+    def _update_file(
+            self,
+            file_id: str,
+            media: MediaIoBaseUpload,
+            metadata: dict | None = None
+    ) -> dict:
+        return self.service.files().update(
             fileId=file_id,
-            media_body=media
+            body=metadata,
+            media_body=media,
+            fields=FILE_FIELDS
         ).execute()
-        return file_id
 
-    def _create_file(self, media: MediaIoBaseUpload, metadata: dict) -> str:
-        uploaded_file = self.service.files().create(
+    @staticmethod
+    def _media(file: IO[bytes], mimetype: str) -> MediaIoBaseUpload:
+        size = file.seek(0, io.SEEK_END)
+        file.seek(0)
+        # large files are sent in chunks over a resumable session, which
+        # continues from the last stored chunk when a request is retried
+        return MediaIoBaseUpload(
+            file,
+            mimetype=mimetype,
+            chunksize=settings.GOOGLE_DRIVE_CHUNK_SIZE,
+            resumable=size > settings.GOOGLE_DRIVE_RESUMABLE_THRESHOLD
+        )
+
+    def _create_file(self, media: MediaIoBaseUpload, metadata: dict) -> dict:
+        return self.service.files().create(
             body=metadata,
             media_body=media,
-            fields='id'
+            fields=FILE_FIELDS
         ).execute()
-        return uploaded_file['id']
 
-    def upload(self, filename: str, file: io.BytesIO, parent_id: str) -> str:
+    def upload(
+            self,
+            filename: str,
+            file: IO[bytes],
+            parent_id: str,
+            mimetype: str = 'application/octet-stream',
+            app_properties: dict | None = None
+    ) -> str:
 
         file_metadata = {
             'name': filename,
             'parents': [parent_id]
         }
+        if app_properties:
+            file_metadata['appProperties'] = app_properties
 
-        media = MediaIoBaseUpload(file, mimetype='application/octet-stream')
+        media = self._media(file, mimetype=mimetype)
 
         file = self._get_file(filename=filename, parent_id=parent_id)
 
         if file:
-            file_id =  self._update_file(file_id=file['id'], media=media)
-            print(f"File {filename} updated successfully. (UPDATED)")
-            return file_id
+            file = self._update_file(
+                file_id=file['id'],
+                media=media,
+                metadata={'appProperties': app_properties} if app_properties else None
+            )
+            self._remember_file(parent_id, file)
+            logger.debug(f'File {filename} updated successfully. (UPDATED)')
+            return file['id']
 
-        file_id = self._create_file(media=media, metadata=file_metadata)
-        print(f"File {filename} uploaded successfully. (CREATED)")
-        return file_id
+        try:
+            file = self._create_file(media=media, metadata=file_metadata)
+        except HttpError as e:
+            self._invalidate_missing_folder(e, parent_id)
+            raise
+        self._remember_file(parent_id, file)
+        logger.debug(f'File {filename} uploaded successfully. (CREATED)')
+        return file['id']
+
+    def upload_if_changed(
+            self,
+            filename: str,
+            file: IO[bytes],
+            parent_id: str,
+            mimetype: str = 'application/octet-stream'
+    ) -> tuple[str, bool]:
+        existing = self._get_file(filename=filename, parent_id=parent_id)
+        if existing and existing.get('md5Checksum') == md5_checksum_file(file):
+            logger.debug(f'File {filename} is up to date. (SKIPPED)')
+            return existing['id'], False
+
+        file_id = self.upload(
+            filename=filename,
+            file=file,
+            parent_id=parent_id,
+            mimetype=mimetype
+        )
+        return file_id, True
+
+    def is_converted(self, pdf_name: str, parent_id: str, source_md5: str) -> bool:
+        existing = self._get_file(filename=pdf_name, parent_id=parent_id)
+        if not existing:
+            return False
+        return existing.get('appProperties', {}).get('source_md5') == source_md5
 
     def create_folder_structure(self, name: str) -> str:
         path_parts = name.strip('/').split('/')
 
         parent_id = self.root_folder_id
-        for folder_name in path_parts:
-            parent_id = self._get_or_create_folder(folder_name, parent_id)
-
+        for depth, folder_name in enumerate(path_parts, start=1):
+            path = '/'.join(path_parts[:depth])
+            folder_id = self.folder_cache.get(self.root_folder_id, path)
+            if folder_id is None:
+                folder_id = self._get_or_create_folder(folder_name, parent_id)
+                self.folder_cache.set(self.root_folder_id, path, folder_id)
+            parent_id = folder_id
+
+        self.flush_mirror()
         return parent_id
 
+    def _invalidate_missing_folder(self, error: HttpError, folder_id: str):
+        if error.resp.status == 404:
+            self.folder_cache.invalidate(folder_id)
+            self._unmirror_files([folder_id])
+
     def _get_or_create_folder(self, folder_name, parent_id):
+        if self.is_mirror_synced():
+            folder = self.mirror.find_folder(parent_id=parent_id, name=folder_name)
+            if folder:
+                return folder.file_id
+
         query = (
-            f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' "
+            f"name = '{folder_name}' and mimeType = '{FOLDER_MIME_TYPE}' "
             f"and '{parent_id}' in parents and trashed = false"
         )
         results = self.service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
         files = results.get('files', [])
         if files:
+            self._mirror_files(parent_id, files[:1], mimetype=FOLDER_MIME_TYPE)
             return files[0]['id']
 
         file_metadata = {
             'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder',
+            'mimeType': FOLDER_MIME_TYPE,
             'parents': [parent_id]
         }
 
-        folder = self.service.files().create(body=file_metadata, fields='id').execute()
+        try:
+            folder = self.service.files().create(body=file_metadata, fields='id').execute()
+        except HttpError as e:
+            self._invalidate_missing_folder(e, parent_id)
+            raise
+        self._mirror_files(parent_id, [{**folder, 'name': folder_name}], mimetype=FOLDER_MIME_TYPE)
         return folder['id']
 
     def create_root_folder(self, folder_name: str) -> str:
@@ -134,7 +772,14 @@ class GoogleDriveClient:
         return folder['id']
 
 
-    def convert_docx_to_pdf(self, file_id: str, filename: str, folder_id: str):
+    def convert_docx_to_pdf(
+            self,
+            file_id: str,
+            filename: str,
+            folder_id: str,
+            cleanup: bool = True,
+            app_properties: dict | None = None
+    ):
 
         pdf_name = filename.replace('.docx', '.pdf')
 
@@ -163,24 +808,66 @@ class GoogleDriveClient:
             'parents': [folder_id],
             'mimeType': 'application/pdf'
         }
+        if app_properties:
+            pdf_metadata['appProperties'] = app_properties
 
         pdf_content = request.execute()
 
-        media = MediaIoBaseUpload(
-            io.BytesIO(pdf_content),
-            mimetype='application/pdf'
-        )
+        media = self._media(io.BytesIO(pdf_content), mimetype='application/pdf')
 
         file = self._get_file(filename=pdf_name, parent_id=folder_id)
 
         if file:
-            file_id = self._update_file(file_id=file['id'], media=media)
+            file = self._update_file(
+                file_id=file['id'],
+                media=media,
+                metadata={'appProperties': app_properties} if app_properties else None
+            )
         else:
-            file_id = self._create_file(media=media, metadata=pdf_metadata)
-
-        print(f"Converted {filename} to PDF and saved to destination folder")
-        self.service.files().delete(fileId=copied_file_id).execute()
+            try:
+                file = self._create_file(media=media, metadata=pdf_metadata)
+            except HttpError as e:
+                self._invalidate_missing_folder(e, folder_id)
+                raise
+        self._remember_file(folder_id, file)
+        file_id = file['id']
+
+        logger.debug(f'Converted {filename} to PDF and saved to destination folder')
+        if cleanup:
+            self.service.files().delete(fileId=copied_file_id).execute()
+        else:
+            # removed in bulk by cleanup_temporary_files
+            self.temporary_files.append(copied_file_id)
 
         return file_id
 
 
+
+
+def get_drive_mirror() -> DriveFileRepository | None:
+    # the mirror follows the changes feed, which only the real Drive has
+    if settings.GOOGLE_DRIVE_MIRROR and settings.GOOGLE_DRIVE_BACKEND == 'google':
+        return DriveFileRepository()
+    return None
+
+
+def get_drive_client(metrics: RunMetrics | None = None) -> GoogleDriveClient:
+    if settings.GOOGLE_DRIVE_BACKEND in ('memory', 'disk'):
+        # imported here, the fake client depends on this module
+        from .fake_drive import get_fake_drive_client
+        return get_fake_drive_client(metrics=metrics)
+    return GoogleDriveClient(metrics=metrics, mirror=get_drive_mirror())
+
+
+def get_async_drive_client(metrics: RunMetrics | None = None):
+    if not settings.GOOGLE_DRIVE_ASYNC:
+        return None
+    if settings.GOOGLE_DRIVE_BACKEND != 'google':
+        # the fake backends only have a sync client, uploads go through it
+        logger.warning(
+            f'GOOGLE_DRIVE_ASYNC is ignored with the {settings.GOOGLE_DRIVE_BACKEND} Drive backend'
+        )
+        return None
+    # imported here, the async client depends on this module
+    from .async_drive import AsyncGoogleDriveClient
+    return AsyncGoogleDriveClient(metrics=metrics)
@@ -1,11 +1,30 @@
 import dataclasses
+import functools
+import hashlib
 import io
 import datetime
-
+import logging
+import multiprocessing
+import os
+import re
+import struct
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+from django.conf import settings
+from docx.opc.packuri import PackURI
+from docx.opc.oxml import serialize_part_xml
 from docxtpl import DocxTemplate
+from jinja2 import Environment, Template
 
 from .utils import MONTH_MAPPER
 
+logger = logging.getLogger(__name__)
+
 
 @dataclasses.dataclass
 class Address:
@@ -148,13 +167,460 @@ class Context:
         }
 
 
+# python-docx stamps every zip member with the current time, a fixed one keeps
+# the output and its checksum identical for identical contexts
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+_XML_DECLARATION = b"<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+
+
+def normalize_docx(content: bytes) -> bytes:
+    with zipfile.ZipFile(io.BytesIO(content)) as source, io.BytesIO() as output:
+        with zipfile.ZipFile(output, 'w') as target:
+            for info in source.infolist():
+                member = zipfile.ZipInfo(info.filename, date_time=ZIP_DATE_TIME)
+                member.compress_type = info.compress_type
+                member.external_attr = info.external_attr
+                target.writestr(member, source.read(info))
+        return output.getvalue()
+
+
+class CompiledDocxTemplate(DocxTemplate):
+
+    def __init__(self, content: bytes):
+        super().__init__(io.BytesIO(content))
+        self.content = content
+        self._parts: dict[str, tuple[Template, str]] = {}
+        self._lock = threading.Lock()
+        self._members: list | None = None
+        self._document_xml: tuple[bytes, bytes] | None = None
+        self._templated_parts: dict[str, str] = {}
+
+    def init_docx(self, reload: bool = True):
+        if not self.docx or (self.is_rendered and reload):
+            self.template_file = io.BytesIO(self.content)
+        super().init_docx(reload=reload)
+
+    def build_xml(self, context, jinja_env=None):
+        template, _ = self._compile_part('body', self.get_xml, jinja_env)
+        return self._render_part(template, self.docx._part, context)
+
+    def build_headers_footers_xml(self, context, uri, jinja_env=None):
+        for relKey, part in self.get_headers_footers(uri):
+            template, encoding = self._compile_part(
+                str(part.partname),
+                lambda: self.get_part_xml(part),
+                jinja_env
+            )
+            xml = self._render_part(template, part, context)
+            yield relKey, xml.encode(encoding)
+
+    def _compile_part(self, key: str, load_xml: Callable[[], str], jinja_env=None):
+        # docxtpl patches and compiles every part on each render, here it is
+        # done once per part and reused by the following renders
+        if key not in self._parts:
+            src_xml = load_xml()
+            encoding = self.get_headers_footers_encoding(src_xml)
+            src_xml = self.patch_xml(src_xml)
+            src_xml = re.sub(r"<w:p([ >])", r"\n<w:p\1", src_xml)
+            env = jinja_env or Environment()
+            self._parts[key] = (env.from_string(src_xml), encoding)
+        return self._parts[key]
+
+    def _render_part(self, template: Template, part, context: dict) -> str:
+        self.current_rendering_part = part
+        dst_xml = template.render(context)
+        dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", dst_xml)
+        dst_xml = (
+            dst_xml.replace("{_{", "{{")
+            .replace("}_}", "}}")
+            .replace("{_%", "{%")
+            .replace("%_}", "%}")
+        )
+        return self.resolve_listing(dst_xml)
+
+    def write(self, context: dict, output: io.BytesIO):
+        with self._lock:
+            if self._members is None:
+                self._compile_package()
+
+            if not self._templated_parts:
+                # the lock is held already, the full render must not take it
+                output.write(self._render_bytes(context))
+                return
+
+            rendered = {
+                filename: self._render_member(filename, context)
+                for filename in self._templated_parts
+            }
+            self._write_package(output, rendered)
+
+    def render_bytes(self, context: dict) -> bytes:
+        with io.BytesIO() as output:
+            self.write(context, output)
+            return output.getvalue()
+
+    def _render_bytes(self, context: dict) -> bytes:
+        self.render(context)
+        with io.BytesIO() as output:
+            self.save(output)
+            return normalize_docx(output.getvalue())
+
+    def _compile_package(self):
+        # docxtpl reparses and saves the whole package on every render, here
+        # the package is read once and only the templated parts are rendered
+        self.render_init()
+        document_part = self.docx._part
+
+        templated = {str(document_part.partname): 'body'}
+        for uri in (self.HEADER_URI, self.FOOTER_URI):
+            for rel_key, part in self.get_headers_footers(uri):
+                templated[str(part.partname)] = rel_key
+
+        members = []
+        with zipfile.ZipFile(io.BytesIO(self.content)) as source:
+            for info in source.infolist():
+                name = str(PackURI.from_rel_ref('/', info.filename))
+                if name in templated:
+                    members.append(info.filename)
+                    self._templated_parts[info.filename] = templated[name]
+                    continue
+
+                if (
+                        info.filename in ('docProps/core.xml', 'word/footnotes.xml')
+                        and re.search(rb'{[{%]', source.read(info))
+                ):
+                    # docxtpl renders those too, keep its full render for them
+                    self._templated_parts = {}
+                    break
+
+                members.append(self._copy_member(source, info))
+
+        element = document_part.element
+        body = element.body
+        placeholder = body.makeelement('placeholder')
+        element.replace(body, placeholder)
+        try:
+            xml = serialize_part_xml(element).decode('utf-8')
+        finally:
+            element.replace(placeholder, body)
+        prefix, suffix = re.split(r'<placeholder\s*/>', xml)
+        self._document_xml = (prefix.encode('utf-8'), suffix.encode('utf-8'))
+
+        self._members = members
+
+    def _copy_member(self, source: zipfile.ZipFile, info: zipfile.ZipInfo):
+        member = zipfile.ZipInfo(info.filename, date_time=ZIP_DATE_TIME)
+        member.compress_type = info.compress_type
+        member.external_attr = info.external_attr
+        return member, source.read(info)
+
+    def _render_member(self, filename: str, context: dict) -> bytes:
+        rel_key = self._templated_parts[filename]
+        if rel_key == 'body':
+            self.docx_ids_index = 1000
+            tree = self.fix_tables(self.build_xml(context))
+            self.fix_docpr_ids(tree)
+            prefix, suffix = self._document_xml
+            return prefix + self.xml_to_string(tree).encode('utf-8') + suffix
+
+        part = self.docx._part.rels[rel_key].target_part
+        template, encoding = self._compile_part(
+            str(part.partname),
+            lambda: self.get_part_xml(part),
+        )
+        xml = self._render_part(template, part, context)
+        return _XML_DECLARATION + xml.encode(encoding)
+
+    def _write_package(self, output: io.BytesIO, rendered: dict[str, bytes]):
+        with zipfile.ZipFile(output, 'w') as package:
+            for member in self._members:
+                if isinstance(member, str):
+                    info = zipfile.ZipInfo(member, date_time=ZIP_DATE_TIME)
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.external_attr = 0o600 << 16
+                    package.writestr(info, rendered[member])
+                else:
+                    package.writestr(*member)
+
+
+@dataclasses.dataclass
+class _ZipMember:
+    name: bytes
+    flag_bits: int
+    compress_type: int
+    dostime: int
+    dosdate: int
+    crc: int
+    compress_size: int
+    file_size: int
+    external_attr: int
+    data: bytes
+
+
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_CENTRAL_HEADER = struct.Struct('<4s4B4HL2L5H2L')
+_END_RECORD = struct.Struct('<4s4H2LH')
+
+
+def _dos_date_time(date_time: tuple) -> tuple[int, int]:
+    year, month, day, hour, minute, second = date_time
+    dostime = hour << 11 | minute << 5 | second // 2
+    dosdate = (year - 1980) << 9 | month << 5 | day
+    return dostime, dosdate
+
+
+def _write_zip(output: io.BytesIO, members: list[_ZipMember]):
+    offset = 0
+    offsets = []
+    for member in members:
+        offsets.append(offset)
+        header = _LOCAL_HEADER.pack(
+            b'PK\x03\x04', 20, 0, member.flag_bits, member.compress_type,
+            member.dostime, member.dosdate, member.crc, member.compress_size,
+            member.file_size, len(member.name), 0
+        )
+        output.write(header)
+        output.write(member.name)
+        output.write(member.data)
+        offset += len(header) + len(member.name) + len(member.data)
+
+    central_directory_offset = offset
+    for member, member_offset in zip(members, offsets):
+        header = _CENTRAL_HEADER.pack(
+            b'PK\x01\x02', 20, 0, 20, 0, member.flag_bits, member.compress_type,
+            member.dostime, member.dosdate, member.crc, member.compress_size,
+            member.file_size, len(member.name), 0, 0, 0, 0,
+            member.external_attr, member_offset
+        )
+        output.write(header)
+        output.write(member.name)
+        offset += len(header) + len(member.name)
+
+    output.write(_END_RECORD.pack(
+        b'PK\x05\x06', 0, 0, len(members), len(members),
+        offset - central_directory_offset, central_directory_offset, 0
+    ))
+
+
+class FastDocxTemplate(CompiledDocxTemplate):
+    # copies the untouched members compressed as they are instead of
+    # inflating and deflating them again on every render
+
+    def _write_package(self, output: io.BytesIO, rendered: dict[str, bytes]):
+        members = []
+        for member in self._members:
+            if isinstance(member, _ZipMember):
+                members.append(member)
+            else:
+                members.append(self._deflate(member, rendered[member]))
+        _write_zip(output, members)
+
+    def _copy_member(self, source: zipfile.ZipFile, info: zipfile.ZipInfo) -> _ZipMember:
+        with memoryview(self.content) as content:
+            header = content[info.header_offset:info.header_offset + _LOCAL_HEADER.size]
+            fields = _LOCAL_HEADER.unpack(header)
+            start = info.header_offset + _LOCAL_HEADER.size + fields[10] + fields[11]
+            data = bytes(content[start:start + info.compress_size])
+
+        dostime, dosdate = _dos_date_time(info.date_time)
+        return _ZipMember(
+            name=info.filename.encode('utf-8'),
+            # sizes are written in the local header, no data descriptor follows
+            flag_bits=info.flag_bits & ~0x08,
+            compress_type=info.compress_type,
+            dostime=dostime,
+            dosdate=dosdate,
+            crc=info.CRC,
+            compress_size=info.compress_size,
+            file_size=info.file_size,
+            external_attr=info.external_attr,
+            data=data
+        )
+
+    @staticmethod
+    def _deflate(filename: str, data: bytes) -> _ZipMember:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        dostime, dosdate = _dos_date_time(ZIP_DATE_TIME)
+        return _ZipMember(
+            name=filename.encode('utf-8'),
+            flag_bits=0,
+            compress_type=zipfile.ZIP_DEFLATED,
+            dostime=dostime,
+            dosdate=dosdate,
+            crc=zlib.crc32(data),
+            compress_size=len(compressed),
+            file_size=len(data),
+            external_attr=0o600 << 16,
+            data=compressed
+        )
+
+
+DOCX_TEMPLATE_CLASSES = {
+    'docxtpl': CompiledDocxTemplate,
+    'fast': FastDocxTemplate,
+}
+
+
+class TemplateCache:
+
+    def __init__(
+            self,
+            maxsize: int = 8,
+            template_class: type[CompiledDocxTemplate] = CompiledDocxTemplate
+    ):
+        self.maxsize = maxsize
+        self.template_class = template_class
+        self._templates: OrderedDict[tuple, CompiledDocxTemplate] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> CompiledDocxTemplate | None:
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+            return template
+
+    def add(self, key: tuple, content: bytes) -> CompiledDocxTemplate:
+        template = self.template_class(content)
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+    def get_or_add(self, key: tuple, load: Callable[[], bytes]) -> CompiledDocxTemplate:
+        template = self.get(key)
+        if template is None:
+            template = self.add(key, load())
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+
+template_cache = TemplateCache(
+    template_class=DOCX_TEMPLATE_CLASSES[settings.INVOICES_DOCX_RENDERER]
+)
+
+
 class DocxGenerator:
 
-    def __init__(self, data: dict, template: io.BytesIO):
+    def __init__(self, data: dict, template: io.BytesIO | CompiledDocxTemplate):
         self.data = data
         self.template = template
 
     def generate(self, output: io.BytesIO):
+        if isinstance(self.template, CompiledDocxTemplate):
+            self.template.write(self.data, output)
+            return
+
         doc = DocxTemplate(self.template)
         doc.render(context=self.data)
         doc.save(output)
+
+
+_worker_template: CompiledDocxTemplate | None = None
+
+
+def _init_render_worker(template_class: type[CompiledDocxTemplate], content: bytes):
+    # every pool process receives the template once, not with each document
+    global _worker_template
+    _worker_template = template_class(content)
+
+
+def _render_in_worker(data: dict) -> bytes:
+    return DocxRenderer.render_docx(data=data, template=_worker_template)
+
+
+# pools are kept per template revision, a new revision retires the oldest
+RENDER_POOLS_MAXSIZE = 2
+
+_render_pools: OrderedDict[tuple, ProcessPoolExecutor] = OrderedDict()
+_render_pools_pid: int | None = None
+_render_pools_lock = threading.Lock()
+
+
+def submit_renders(
+        template: CompiledDocxTemplate,
+        items: list[dict],
+        workers: int
+) -> list[Future] | None:
+    # children of the celery prefork pool are daemonic and may not start
+    # processes of their own, they render serially
+    if multiprocessing.current_process().daemon:
+        _warn_serial_rendering()
+        return None
+
+    global _render_pools_pid
+    key = (workers, type(template), hashlib.md5(template.content).hexdigest())
+    with _render_pools_lock:
+        if _render_pools_pid != os.getpid():
+            # pools inherited from a forked parent belong to the parent
+            _render_pools.clear()
+            _render_pools_pid = os.getpid()
+
+        pool = _render_pools.get(key)
+        if pool is None:
+            # the forkserver starts workers from a clean process, not a copy
+            # of this one with its Drive and event loop threads
+            pool = _render_pools[key] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('forkserver'),
+                initializer=_init_render_worker,
+                initargs=(type(template), template.content)
+            )
+            while len(_render_pools) > RENDER_POOLS_MAXSIZE:
+                # renders already submitted to a retired pool still finish
+                _, retired = _render_pools.popitem(last=False)
+                retired.shutdown(wait=False)
+        _render_pools.move_to_end(key)
+
+        # submitted under the lock, so the pool cannot be retired in between
+        return [pool.submit(_render_in_worker, data) for data in items]
+
+
+@functools.cache
+def _warn_serial_rendering():
+    logger.warning(
+        'INVOICES_RENDER_WORKERS is ignored in daemonic processes, '
+        'run the celery worker with --pool solo or --pool threads to render in parallel'
+    )
+
+
+class DocxRenderer:
+
+    def __init__(self, template: CompiledDocxTemplate, workers: int = 1):
+        self.template = template
+        self.workers = workers
+
+    @staticmethod
+    def render_docx(data: dict, template: CompiledDocxTemplate) -> bytes:
+        generator = DocxGenerator(data=data, template=template)
+        with io.BytesIO() as output:
+            generator.generate(output)
+            return output.getvalue()
+
+    def render_many(self, items: Iterable[dict]) -> Iterator[bytes]:
+        items = list(items)
+
+        futures = None
+        if self.workers > 1 and len(items) > 1:
+            futures = submit_renders(self.template, items, self.workers)
+
+        if futures is None:
+            for data in items:
+                yield self.render_docx(data=data, template=self.template)
+            return
+
+        # results are yielded in submission order, so the caller can pair
+        # them with its contexts while the remaining ones are rendered
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
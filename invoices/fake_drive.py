@@ -0,0 +1,319 @@
+import io
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import IO
+
+import httplib2
+from django.conf import settings
+from googleapiclient.errors import HttpError
+
+from .drive import BatchResult, call_with_retries, md5_checksum, md5_checksum_file
+from .metrics import RunMetrics
+
+
+class MemoryStore:
+
+    def __init__(self):
+        self._files: dict[str, dict] = {}
+        self._contents: dict[str, bytes] = {}
+        self.lock = threading.RLock()
+
+    def files(self) -> list[dict]:
+        return list(self._files.values())
+
+    def get(self, file_id: str) -> dict | None:
+        return self._files.get(file_id)
+
+    def read(self, file_id: str) -> bytes:
+        return self._contents[file_id]
+
+    def put(self, file: dict, content: bytes):
+        self._files[file['id']] = file
+        self._contents[file['id']] = content
+
+    def delete(self, file_id: str) -> dict | None:
+        self._contents.pop(file_id, None)
+        return self._files.pop(file_id, None)
+
+
+class DiskStore(MemoryStore):
+
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+        # contents stay on disk, only the metadata is kept in memory
+        for filename in os.listdir(root):
+            if filename.endswith('.json'):
+                with open(os.path.join(root, filename)) as file:
+                    metadata = json.load(file)
+                self._files[metadata['id']] = metadata
+
+    def _path(self, file_id: str, extension: str) -> str:
+        return os.path.join(self.root, f'{file_id}.{extension}')
+
+    def read(self, file_id: str) -> bytes:
+        with open(self._path(file_id, 'bin'), 'rb') as file:
+            return file.read()
+
+    def put(self, file: dict, content: bytes):
+        with open(self._path(file['id'], 'bin'), 'wb') as output:
+            output.write(content)
+        with open(self._path(file['id'], 'json'), 'w') as output:
+            json.dump(file, output)
+        self._files[file['id']] = file
+
+    def delete(self, file_id: str) -> dict | None:
+        for extension in ('bin', 'json'):
+            try:
+                os.remove(self._path(file_id, extension))
+            except FileNotFoundError:
+                pass
+        return self._files.pop(file_id, None)
+
+
+_memory_store = MemoryStore()
+
+
+class FakeDriveClient:
+
+    def __init__(
+            self,
+            store: MemoryStore | None = None,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            error_rate: float = 0.0,
+            error_status: int = 503,
+            metrics: RunMetrics | None = None
+    ):
+        # one store per process by default, so chained tasks share folders
+        self.store = store or _memory_store
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.metrics = metrics
+
+        self.root_folder_id = 'root'
+        # the in-process store is its own index, there is nothing to mirror
+        self.mirror = None
+        self.temporary_files: list[str] = []
+
+        with self.store.lock:
+            self._names = {
+                (file['parents'][0], file['name']): file['id']
+                for file in self.store.files()
+            }
+
+    def add_file(
+            self,
+            filename: str,
+            content: bytes,
+            parent_id: str | None = None,
+            file_id: str | None = None,
+            app_properties: dict | None = None
+    ) -> str:
+        file_id = file_id or uuid.uuid4().hex
+        parent_id = parent_id or self.root_folder_id
+        with self.store.lock:
+            self._names.setdefault((parent_id, filename), file_id)
+            self.store.put(
+                {
+                    'id': file_id,
+                    'name': filename,
+                    'parents': [parent_id],
+                    'md5Checksum': md5_checksum(content),
+                    'appProperties': app_properties or {},
+                },
+                content
+            )
+        return file_id
+
+    def _call(self, method: str):
+        def call():
+            if self.metrics is not None:
+                self.metrics.count(f'calls.drive.files.{method}')
+
+            if self.latency or self.jitter:
+                time.sleep(self.latency + random.uniform(0, self.jitter))
+
+            if self.error_rate and random.random() < self.error_rate:
+                raise HttpError(
+                    resp=httplib2.Response({'status': self.error_status}),
+                    content=json.dumps({
+                        'error': {'code': self.error_status, 'message': 'Injected error'}
+                    }).encode('utf-8')
+                )
+
+        # injected errors go through the same backoff as the real client,
+        # which does not send a failed create or copy again
+        call_with_retries(call, metrics=self.metrics, idempotent=method not in ('create', 'copy'))
+
+    def _batch_call(self, method: str, key: str, call) -> BatchResult:
+        try:
+            self._call(method)
+        except HttpError as e:
+            return BatchResult(key=key, error=e)
+        return BatchResult(key=key, response=call())
+
+    def _find(self, filename: str, parent_id: str) -> dict | None:
+        file_id = self._names.get((parent_id, filename))
+        return self.store.get(file_id) if file_id else None
+
+    def _not_found(self, file_id: str) -> HttpError:
+        return HttpError(
+            resp=httplib2.Response({'status': 404}),
+            content=f'File not found: {file_id}'.encode('utf-8')
+        )
+
+    def download(self, file_id: str) -> io.BytesIO:
+        self._call('get')
+        if self.store.get(file_id) is None:
+            raise self._not_found(file_id)
+        return io.BytesIO(self.store.read(file_id))
+
+    def get_md5_checksum(self, file_id: str) -> str:
+        self._call('get')
+        file = self.store.get(file_id)
+        if file is None:
+            raise self._not_found(file_id)
+        return file['md5Checksum']
+
+    def delete_files(self, file_ids: list[str]) -> dict[str, BatchResult]:
+        def delete(file_id):
+            with self.store.lock:
+                file = self.store.delete(file_id)
+                if file is not None:
+                    key = (file['parents'][0], file['name'])
+                    if self._names.get(key) == file_id:
+                        del self._names[key]
+            return {}
+
+        return {
+            file_id: self._batch_call('delete', file_id, lambda: delete(file_id))
+            for file_id in file_ids
+        }
+
+    def cleanup_temporary_files(self) -> dict[str, BatchResult]:
+        file_ids, self.temporary_files = self.temporary_files, []
+        return self.delete_files(file_ids)
+
+    def flush_mirror(self):
+        pass
+
+    def index_folder(self, folder_id: str) -> dict[str, dict]:
+        self._call('list')
+        index = {}
+        for file in self.store.files():
+            if folder_id in file['parents']:
+                index.setdefault(file['name'], file)
+        return index
+
+    def upload(
+            self,
+            filename: str,
+            file: IO[bytes],
+            parent_id: str,
+            mimetype: str = 'application/octet-stream',
+            app_properties: dict | None = None
+    ) -> str:
+        existing = self._find(filename, parent_id)
+        self._call('update' if existing else 'create')
+        file.seek(0)
+        content = file.read()
+        if self.metrics is not None:
+            self.metrics.count('drive.bytes_sent', len(content))
+        return self.add_file(
+            filename=filename,
+            content=content,
+            parent_id=parent_id,
+            file_id=existing['id'] if existing else None,
+            app_properties=app_properties
+        )
+
+    def upload_if_changed(
+            self,
+            filename: str,
+            file: IO[bytes],
+            parent_id: str,
+            mimetype: str = 'application/octet-stream'
+    ) -> tuple[str, bool]:
+        existing = self._find(filename, parent_id)
+        if existing and existing['md5Checksum'] == md5_checksum_file(file):
+            return existing['id'], False
+        return self.upload(filename, file, parent_id, mimetype), True
+
+    def is_converted(self, pdf_name: str, parent_id: str, source_md5: str) -> bool:
+        existing = self._find(pdf_name, parent_id)
+        if not existing:
+            return False
+        return existing['appProperties'].get('source_md5') == source_md5
+
+    def create_folder_structure(self, name: str) -> str:
+        parent_id = self.root_folder_id
+        for folder_name in name.strip('/').split('/'):
+            with self.store.lock:
+                folder = self._find(folder_name, parent_id)
+                if folder is None:
+                    self._call('create')
+                    parent_id = self.add_file(folder_name, b'', parent_id=parent_id)
+                else:
+                    parent_id = folder['id']
+        return parent_id
+
+    def convert_docx_to_pdf(
+            self,
+            file_id: str,
+            filename: str,
+            folder_id: str,
+            cleanup: bool = True,
+            app_properties: dict | None = None
+    ) -> str:
+        self._call('copy')
+        content = self.store.read(file_id)
+        copied_file_id = self.add_file(filename, content)
+
+        # a stand-in document, nothing reads the PDF content back
+        self._call('export')
+        with io.BytesIO(b'%PDF-1.4\n' + content[:64]) as buffer:
+            pdf_id = self.upload(
+                filename=filename.replace('.docx', '.pdf'),
+                file=buffer,
+                parent_id=folder_id,
+                mimetype='application/pdf',
+                app_properties=app_properties
+            )
+
+        if cleanup:
+            self.delete_files([copied_file_id])
+        else:
+            self.temporary_files.append(copied_file_id)
+        return pdf_id
+
+
+def get_fake_drive_client(metrics: RunMetrics | None = None) -> FakeDriveClient:
+    store = None
+    if settings.GOOGLE_DRIVE_BACKEND == 'disk':
+        store = DiskStore(settings.GOOGLE_DRIVE_FAKE_ROOT)
+
+    client = FakeDriveClient(
+        store=store,
+        latency=settings.GOOGLE_DRIVE_FAKE_LATENCY,
+        jitter=settings.GOOGLE_DRIVE_FAKE_JITTER,
+        error_rate=settings.GOOGLE_DRIVE_FAKE_ERROR_RATE,
+        metrics=metrics
+    )
+
+    # the customer template is served from the local copy
+    template_id = settings.GOOGLE_DRIVE_DOCX_TEMPLATES.get('customers')
+    template_path = settings.INVOICES_LOCAL_TEMPLATE_PATH
+    if template_id and client.store.get(template_id) is None and os.path.exists(template_path):
+        with open(template_path, 'rb') as file:
+            client.add_file('customers.docx', file.read(), file_id=template_id)
+
+    return client
@@ -0,0 +1,285 @@
+import datetime
+import io
+import json
+import platform
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from django.conf import settings
+from docx import Document
+
+from invoices.engine import (
+    DOCX_TEMPLATE_CLASSES,
+    DocxGenerator,
+    Address,
+    BankAccount,
+    Client,
+    Contact,
+    Content,
+    Context,
+    Contractor,
+    Item,
+    template_cache,
+)
+from invoices.fake_drive import FakeDriveClient, MemoryStore
+from invoices.metrics import RunMetrics, percentile
+from invoices.models import Customer, Employee, Employer, Work
+from invoices.repositories import (
+    EmployersRepository,
+    CustomersRepository,
+    WorkRepository,
+    CustomerInvoiceRepository
+)
+from invoices.services import GenerateCustomerInvoicesService
+
+MONTH = datetime.date(2025, 1, 1)
+
+TEMPLATE_ID = 'bench-template'
+
+
+def build_template() -> bytes:
+    document = Document()
+    document.add_paragraph('Rechnung {{ cnt.invoice_number }} vom {{ cnt.issue_date }}')
+    document.add_paragraph('{{ cl.name }}, {{ cl.a.street }}, {{ cl.a.code }} {{ cl.a.city }}')
+    document.add_paragraph('{{ co.company }} {{ co.name }} {{ co.number }}')
+
+    table = document.add_table(rows=3, cols=3)
+    table.rows[0].cells[0].text = '{%tr for item in cnt.items_ %}'
+    table.rows[1].cells[0].text = '{{ item.date }}'
+    table.rows[1].cells[1].text = '{{ item.hours }}'
+    table.rows[1].cells[2].text = '{{ item.total }}'
+    table.rows[2].cells[0].text = '{%tr endfor %}'
+
+    document.add_paragraph('Netto {{ cnt.netto }} Brutto {{ cnt.brutto }}')
+    document.add_paragraph('{{ cnt.note }}')
+    document.sections[0].header.paragraphs[0].text = '{{ cnt.month }} {{ cnt.year }}'
+
+    with io.BytesIO() as output:
+        document.save(output)
+        return output.getvalue()
+
+
+def build_contexts(customers: int, items: int) -> list[Context]:
+    address = Address(street_name='Hauptstr. 1', city='Berlin', zip_code='10115')
+    contractor = Contractor(
+        company='Cleaning',
+        name='Employer',
+        number='St.Nr. 1 USt-Id.Nr: DE1',
+        address=address,
+        bank_account=BankAccount(bank_name='Bank', iban='DE00', bic='BIC'),
+        contact=Contact(email='employer@example.com', phone='123')
+    )
+    return [
+        Context(
+            client=Client(name=f'Customer {index}', address=address),
+            contractor=contractor,
+            content=Content(
+                invoice_number=index + 1,
+                issue_date=MONTH.replace(day=31),
+                items=[
+                    Item(
+                        hours=2.5,
+                        price=5000,
+                        date=MONTH.replace(day=day % 28 + 1)
+                    )
+                    for day in range(items)
+                ],
+                note='',
+                year=MONTH.year,
+                month=MONTH.month
+            )
+        )
+        for index in range(customers)
+    ]
+
+
+def seed_database(customers: int, items: int):
+    address = {'street_name': 'Hauptstr. 1', 'zip_code': '10115', 'city': 'Berlin'}
+    Employer.objects.create(
+        name='Employer',
+        data={
+            'company': 'Cleaning',
+            'st_nr': '1',
+            'vat_id': 'DE1',
+            'address': address,
+            'bank_account': {'bank_name': 'Bank', 'iban': 'DE00', 'bic': 'BIC'},
+            'contact': {'email': 'employer@example.com', 'phone': '123'},
+        }
+    )
+    employee = Employee.objects.create(name='Employee', code='EE')
+    created = Customer.objects.bulk_create([
+        Customer(
+            name=f'Bench Customer {index}',
+            price=2000,
+            data={'name': f'Bench Customer {index}', 'address': address, 'note': ''}
+        )
+        for index in range(customers)
+    ])
+    Work.objects.bulk_create([
+        Work(
+            customer=customer,
+            employee=employee,
+            hours=2.5,
+            date=MONTH.replace(day=day % 28 + 1)
+        )
+        for customer in created
+        for day in range(items)
+    ])
+
+
+def summarize(samples: list[float], total: float) -> dict:
+    return {
+        'count': len(samples),
+        'total_s': round(total, 4),
+        'throughput_per_s': round(len(samples) / total, 2) if total else None,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def timed(func, items) -> dict:
+    samples = []
+    start_time = time.perf_counter()
+    for item in items:
+        item_start_time = time.perf_counter()
+        func(item)
+        samples.append(time.perf_counter() - item_start_time)
+    return summarize(samples, time.perf_counter() - start_time)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark invoice rendering and generation against an in-memory Drive, '
+        'in a test database created for the run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=100)
+        parser.add_argument('--items', type=int, default=20)
+        parser.add_argument('--workers', type=int, default=settings.INVOICES_RENDER_WORKERS)
+        parser.add_argument(
+            '--upload-workers',
+            type=int,
+            default=settings.INVOICES_UPLOAD_WORKERS
+        )
+        parser.add_argument(
+            '--renderer',
+            choices=sorted(DOCX_TEMPLATE_CLASSES),
+            default=settings.INVOICES_DOCX_RENDERER
+        )
+        parser.add_argument(
+            '--drive-latency',
+            type=float,
+            default=0.0,
+            help='Seconds added to every fake Drive call.'
+        )
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        customers, items = options['customers'], options['items']
+        template_content = build_template()
+        template_class = DOCX_TEMPLATE_CLASSES[options['renderer']]
+
+        contexts = build_contexts(customers, items)
+        data = [context.dict() for context in contexts]
+        template = template_class(template_content)
+
+        results = {
+            'context_dict': timed(lambda context: context.dict(), contexts),
+            'docx_generate': timed(
+                lambda item: DocxGenerator(data=item, template=template).generate(io.BytesIO()),
+                data
+            ),
+        }
+
+        # the service reads the first employer and every customer with works
+        # in the month, so it runs on seeded data in a database of its own
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            results['service'] = self.bench_service(
+                customers=customers,
+                items=items,
+                workers=options['workers'],
+                upload_workers=options['upload_workers'],
+                template_content=template_content,
+                template_class=template_class,
+                drive_latency=options['drive_latency']
+            )
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        report = {
+            'config': {
+                'customers': customers,
+                'items': items,
+                'workers': options['workers'],
+                'upload_workers': options['upload_workers'],
+                'renderer': options['renderer'],
+                'drive_latency': options['drive_latency'],
+                'python': platform.python_version(),
+            },
+            'results': results,
+            'peak_rss_kb': {
+                'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            },
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    @staticmethod
+    def bench_service(
+            customers: int,
+            items: int,
+            workers: int,
+            upload_workers: int,
+            template_content: bytes,
+            template_class: type,
+            drive_latency: float = 0.0
+    ) -> dict:
+        metrics = RunMetrics()
+        drive = FakeDriveClient(store=MemoryStore(), latency=drive_latency, metrics=metrics)
+        drive.add_file('customers.docx', template_content, file_id=TEMPLATE_ID)
+
+        templates = {**settings.GOOGLE_DRIVE_DOCX_TEMPLATES, 'customers': TEMPLATE_ID}
+        with override_settings(GOOGLE_DRIVE_DOCX_TEMPLATES=templates):
+            seed_database(customers, items)
+
+            service = GenerateCustomerInvoicesService(
+                start_date=MONTH,
+                end_date=MONTH.replace(day=31),
+                drive=drive,
+                employer_repo=EmployersRepository(),
+                customer_repo=CustomersRepository(),
+                work_repo=WorkRepository(),
+                invoice_repo=CustomerInvoiceRepository(),
+                last_invoice_number='0',
+                render_workers=workers,
+                metrics=metrics,
+                upload_workers=upload_workers
+            )
+            # the service compiles the template through the shared cache
+            template_cache.template_class, previous_class = (
+                template_class, template_cache.template_class
+            )
+            template_cache.clear()
+            try:
+                start_time = time.perf_counter()
+                service.execute()
+                total = time.perf_counter() - start_time
+            finally:
+                template_cache.template_class = previous_class
+                template_cache.clear()
+
+        per_invoice = [sum(samples.values()) for samples in metrics.samples_by_key.values()]
+        return {
+            **summarize(per_invoice, total),
+            'stages': metrics.summary()['stages'],
+        }
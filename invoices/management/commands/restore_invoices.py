@@ -6,7 +6,14 @@ from invoices.tasks import restore_customer_invoices
 class Command(BaseCommand):
     help = 'Restore invoices data from database to Google Drive.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue from the checkpoint of an interrupted restore.'
+        )
+
     def handle(self, *args, **options):
-        restore_customer_invoices.delay()
+        restore_customer_invoices.delay(resume=options['resume'])
 
         self.stdout.write(self.style.SUCCESS('Command executed successfully!'))
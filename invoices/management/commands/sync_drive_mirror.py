@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from invoices.tasks import sync_drive_mirror
+
+
+class Command(BaseCommand):
+    help = 'Sync the database mirror of the Google Drive folder tree.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Drop the mirror and list the whole folder tree again.'
+        )
+
+    def handle(self, *args, **options):
+        sync_drive_mirror.delay(full=options['full'])
+
+        self.stdout.write(self.style.SUCCESS('Command executed successfully!'))
@@ -0,0 +1,84 @@
+import contextlib
+import math
+import threading
+import time
+from collections import defaultdict
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class RunMetrics:
+
+    def __init__(self):
+        self.stages: dict[str, float] = defaultdict(float)
+        self.counters: dict[str, int] = defaultdict(int)
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        # samples of one invoice, uploads finish out of order with workers
+        self.samples_by_key: dict[str, dict[str, float]] = defaultdict(dict)
+        # uploads can be timed from several threads
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            run_time = time.perf_counter() - start_time
+            with self._lock:
+                self.stages[name] += run_time
+
+    @contextlib.contextmanager
+    def sample(self, name: str, key: str | None = None):
+        # per invoice timing, also added to the stage total
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            run_time = time.perf_counter() - start_time
+            with self._lock:
+                self.stages[name] += run_time
+                self.samples[name].append(run_time)
+                if key is not None:
+                    self.samples_by_key[key][name] = run_time
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def merge(self, data: dict):
+        for name, value in data.get('stages', {}).items():
+            self.stages[name] += value
+        for name, value in data.get('counters', {}).items():
+            self.counters[name] += value
+        for name, values in data.get('samples', {}).items():
+            self.samples[name].extend(values)
+
+    def dict(self) -> dict:
+        return {
+            'stages': dict(self.stages),
+            'counters': dict(self.counters),
+            'samples': dict(self.samples),
+        }
+
+    def summary(self) -> dict:
+        return {
+            'stages': {
+                name: round(value, 3) for name, value in self.stages.items()
+            },
+            'counters': dict(sorted(self.counters.items())),
+            'per_invoice': {
+                name: {
+                    'count': len(values),
+                    'p50': round(percentile(values, 50), 3),
+                    'p95': round(percentile(values, 95), 3),
+                }
+                for name, values in self.samples.items()
+                if values
+            },
+        }
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerinvoice',
+            name='year',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='customerinvoice',
+            name='month',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+    ]
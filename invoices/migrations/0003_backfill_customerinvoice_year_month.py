@@ -0,0 +1,59 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:13
+
+import datetime
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def _invoice_date(invoice) -> datetime.date:
+    content = invoice.data.get('cnt', {})
+    # December issue dates were stamped a year early, the work dates never were
+    dates = [item.get('date') for item in content.get('items_', [])]
+    for value in dates + [content.get('issue_date')]:
+        if value:
+            return datetime.datetime.strptime(value, '%d.%m.%Y')
+    return invoice.created_at
+
+
+def backfill_year_month(apps, schema_editor):
+    CustomerInvoice = apps.get_model('invoices', 'CustomerInvoice')
+
+    invoices = defaultdict(list)
+    for invoice in CustomerInvoice.objects.order_by('id'):
+        date = _invoice_date(invoice)
+
+        invoice.year = date.year
+        invoice.month = date.month
+        invoices[(invoice.customer_id, date.year, date.month)].append(invoice)
+
+    # duplicates may carry different issued numbers, they are resolved by hand
+    conflicts = [
+        f'customer {customer_id} {year}/{month:02d}: ' + ', '.join(
+            f'invoice {invoice.id} (number {invoice.data.get("cnt", {}).get("invoice_number")})'
+            for invoice in duplicates
+        )
+        for (customer_id, year, month), duplicates in invoices.items()
+        if len(duplicates) > 1
+    ]
+    if conflicts:
+        raise RuntimeError(
+            'Customers have more than one invoice per month, keep one of each '
+            'before migrating:\n' + '\n'.join(conflicts)
+        )
+
+    CustomerInvoice.objects.bulk_update(
+        [invoice for duplicates in invoices.values() for invoice in duplicates],
+        fields=['year', 'month']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0002_customerinvoice_year_month'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_year_month, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0003_backfill_customerinvoice_year_month'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customerinvoice',
+            name='year',
+            field=models.PositiveSmallIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='customerinvoice',
+            name='month',
+            field=models.PositiveSmallIntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='customerinvoice',
+            constraint=models.UniqueConstraint(fields=('customer', 'year', 'month'), name='unique_customer_invoice_month'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0004_customerinvoice_unique_customer_invoice_month'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customerinvoice',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0007_generationrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationrun',
+            name='folder_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='generationrun',
+            name='incremental',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='GenerationRunItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('invoice_number', models.IntegerField()),
+                ('stage', models.CharField(choices=[('pending', 'Pending'), ('uploaded', 'Uploaded'), ('converted', 'Converted'), ('persisted', 'Persisted')], default='pending', max_length=20)),
+                ('file_id', models.CharField(blank=True, default='', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='invoices.customer')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='invoices.generationrun')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('run', 'customer'), name='unique_generation_run_customer')],
+            },
+        ),
+    ]
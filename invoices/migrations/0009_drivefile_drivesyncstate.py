@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0008_generationrun_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriveFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_id', models.CharField(max_length=100, unique=True)),
+                ('parent_id', models.CharField(blank=True, default='', max_length=100)),
+                ('name', models.CharField(max_length=255)),
+                ('mime_type', models.CharField(blank=True, default='', max_length=100)),
+                ('md5_checksum', models.CharField(blank=True, default='', max_length=32)),
+                ('app_properties', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['parent_id', 'name'], name='drive_file_parent_name')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DriveSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('root_folder_id', models.CharField(max_length=100, unique=True)),
+                ('page_token', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0009_drivefile_drivesyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationrun',
+            name='attempt',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
@@ -120,13 +120,31 @@ class Work(models.Model):
 
 class CustomerInvoice(models.Model):
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['customer', 'year', 'month'],
+                name='unique_customer_invoice_month'
+            ),
+        ]
+
     customer = models.ForeignKey(
         Customer,
         on_delete=models.CASCADE
     )
 
+    year = models.PositiveSmallIntegerField()
+
+    month = models.PositiveSmallIntegerField()
+
     data = models.JSONField(default=dict)
 
+    fingerprint = models.CharField(
+        max_length=64,
+        blank=True,
+        default=''
+    )
+
     created_at = models.DateTimeField(
         auto_now_add=True
     )
@@ -138,3 +156,205 @@ class CustomerInvoice(models.Model):
     @property
     def number(self):
         return self.data.get('cnt', {}).get('invoice_number')
+
+
+class RestoreCheckpoint(models.Model):
+
+    name = models.CharField(
+        max_length=100,
+        unique=True
+    )
+
+    year = models.PositiveSmallIntegerField()
+
+    month = models.PositiveSmallIntegerField()
+
+    invoice_id = models.IntegerField()
+
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    def __str__(self) -> str:
+        return f"{self.name} | {self.year}/{self.month:02d} | {self.invoice_id}"
+
+
+class GenerationRun(models.Model):
+
+    class Status(models.TextChoices):
+        RUNNING = 'running'
+        FINISHED = 'finished'
+
+    year = models.PositiveSmallIntegerField()
+
+    month = models.PositiveSmallIntegerField()
+
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.RUNNING
+    )
+
+    folder_id = models.CharField(
+        max_length=100,
+        blank=True,
+        default=''
+    )
+
+    incremental = models.BooleanField(default=False)
+
+    attempt = models.PositiveSmallIntegerField(default=1)
+
+    metrics = models.JSONField(default=dict)
+
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    def __str__(self) -> str:
+        return f"Run {self.year}/{self.month:02d} | {self.status}"
+
+
+class GenerationRunItem(models.Model):
+
+    class Stage(models.TextChoices):
+        PENDING = 'pending'
+        UPLOADED = 'uploaded'
+        CONVERTED = 'converted'
+        PERSISTED = 'persisted'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['run', 'customer'],
+                name='unique_generation_run_customer'
+            ),
+        ]
+
+    run = models.ForeignKey(
+        GenerationRun,
+        on_delete=models.CASCADE,
+        related_name='items'
+    )
+
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE
+    )
+
+    invoice_number = models.IntegerField()
+
+    stage = models.CharField(
+        max_length=20,
+        choices=Stage.choices,
+        default=Stage.PENDING
+    )
+
+    file_id = models.CharField(
+        max_length=100,
+        blank=True,
+        default=''
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    def __str__(self) -> str:
+        return f"Run {self.run_id} | {self.customer_id} | {self.stage}"
+
+    def reached(self, stage: str) -> bool:
+        stages = list(self.Stage)
+        return stages.index(self.stage) >= stages.index(stage)
+
+
+class DriveFile(models.Model):
+
+    FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['parent_id', 'name'],
+                name='drive_file_parent_name'
+            ),
+        ]
+
+    file_id = models.CharField(
+        max_length=100,
+        unique=True
+    )
+
+    parent_id = models.CharField(
+        max_length=100,
+        blank=True,
+        default=''
+    )
+
+    name = models.CharField(max_length=255)
+
+    mime_type = models.CharField(
+        max_length=100,
+        blank=True,
+        default=''
+    )
+
+    md5_checksum = models.CharField(
+        max_length=32,
+        blank=True,
+        default=''
+    )
+
+    app_properties = models.JSONField(default=dict)
+
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    def __str__(self) -> str:
+        return f"{self.name} | {self.file_id}"
+
+    @property
+    def is_folder(self) -> bool:
+        return self.mime_type == self.FOLDER_MIME_TYPE
+
+    def dict(self) -> dict:
+        return {
+            'id': self.file_id,
+            'name': self.name,
+            'md5Checksum': self.md5_checksum,
+            'appProperties': self.app_properties,
+        }
+
+
+class DriveSyncState(models.Model):
+
+    root_folder_id = models.CharField(
+        max_length=100,
+        unique=True
+    )
+
+    page_token = models.CharField(max_length=100)
+
+    created_at = models.DateTimeField(
+        auto_now_add=True
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    def __str__(self) -> str:
+        return f"{self.root_folder_id} | {self.page_token}"
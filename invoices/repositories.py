@@ -1,10 +1,26 @@
 import datetime
+from collections import defaultdict
 
+from typing import Iterator
+
+from django.db import transaction
+from django.utils import timezone
 from django.db.models import (
-    QuerySet, Prefetch, Sum, ExpressionWrapper, F, IntegerField
+    QuerySet, Sum, ExpressionWrapper, F, IntegerField, Q
 )
 
-from invoices.models import Employer, Work, Customer, CustomerInvoice, Employee
+from invoices.models import (
+    Employer,
+    Work,
+    Customer,
+    CustomerInvoice,
+    Employee,
+    RestoreCheckpoint,
+    GenerationRun,
+    GenerationRunItem,
+    DriveFile,
+    DriveSyncState
+)
 
 
 class EmployersRepository:
@@ -29,15 +45,29 @@ class CustomersRepository:
     def get_for_invoice(
             start_date: datetime.date,
             end_date: datetime.date,
-            works: QuerySet[Work]
-    ):
-        return (
+            customer_ids: list[int] | None = None
+    ) -> QuerySet[Customer]:
+        customers = (
             Customer.objects
             .filter(works__date__range=(start_date, end_date))
-            .prefetch_related(
-                Prefetch('works', queryset=works)
-            )
             .distinct()
+            .order_by('id')
+        )
+        if customer_ids is not None:
+            customers = customers.filter(id__in=customer_ids)
+        return customers
+
+    @staticmethod
+    def get_ids_for_invoice(
+            start_date: datetime.date,
+            end_date: datetime.date
+    ) -> list[int]:
+        return list(
+            Customer.objects
+            .filter(works__date__range=(start_date, end_date))
+            .values_list('id', flat=True)
+            .distinct()
+            .order_by('id')
         )
 
     @staticmethod
@@ -65,14 +95,20 @@ class EmployeesRepository:
 class WorkRepository:
 
     @staticmethod
-    def get_for_invoice(
-            start_date: datetime.date, end_date: datetime.date
-    ) -> QuerySet[Work]:
-        return (
-            Work.objects
-            .filter(date__range=(start_date, end_date))
-            .select_related('customer')
+    def get_daily_totals(
+            start_date: datetime.date,
+            end_date: datetime.date,
+            customer_ids: list[int] | None = None
+    ) -> dict[int, list[dict]]:
+        works = Work.objects.filter(date__range=(start_date, end_date))
+        if customer_ids is not None:
+            works = works.filter(customer_id__in=customer_ids)
+
+        rows = (
+            works
+            .values('customer_id', 'date')
             .annotate(
+                total_hours=Sum('hours'),
                 total_price=Sum(
                     ExpressionWrapper(
                         F('customer__price') * F('hours'),
@@ -80,17 +116,31 @@ class WorkRepository:
                     )
                 )
             )
-            .order_by('date')
+            .order_by('customer_id', 'date')
         )
 
+        daily_totals = defaultdict(list)
+        for row in rows:
+            daily_totals[row['customer_id']].append(row)
+        return daily_totals
+
 
 class CustomerInvoiceRepository:
 
     @staticmethod
-    def create_draft(customer_id: int, data: dict) -> CustomerInvoice:
+    def create_draft(
+            customer_id: int,
+            year: int,
+            month: int,
+            data: dict,
+            fingerprint: str = ''
+    ) -> CustomerInvoice:
         return CustomerInvoice(
             customer_id=customer_id,
+            year=year,
+            month=month,
             data=data,
+            fingerprint=fingerprint,
         )
 
     @staticmethod
@@ -104,13 +154,267 @@ class CustomerInvoiceRepository:
             fields=['data', 'updated_at']
         )
 
+    @staticmethod
+    def upsert_many(invoices: list[CustomerInvoice]):
+        CustomerInvoice.objects.bulk_create(
+            invoices,
+            update_conflicts=True,
+            unique_fields=['customer', 'year', 'month'],
+            update_fields=['data', 'fingerprint', 'updated_at']
+        )
+
     @staticmethod
     def get_all() -> QuerySet[CustomerInvoice]:
         return CustomerInvoice.objects.all()
 
+    @staticmethod
+    def iter_for_restore(
+            after: RestoreCheckpoint | None = None,
+            chunk_size: int = 100
+    ) -> Iterator[CustomerInvoice]:
+        invoices = CustomerInvoice.objects.select_related('customer')
+        if after is not None:
+            invoices = invoices.filter(
+                Q(year__gt=after.year)
+                | Q(year=after.year, month__gt=after.month)
+                | Q(year=after.year, month=after.month, id__gt=after.invoice_id)
+            )
+        return (
+            invoices
+            .order_by('year', 'month', 'id')
+            .iterator(chunk_size=chunk_size)
+        )
+
     @staticmethod
     def get_by_month(year: int, month: int) -> QuerySet[CustomerInvoice]:
         return CustomerInvoice.objects.filter(
-            data__year=year,
-            data__month=month
+            year=year,
+            month=month
+        )
+
+    @staticmethod
+    def get_fingerprints(year: int, month: int) -> dict[int, str]:
+        return dict(
+            CustomerInvoice.objects
+            .filter(year=year, month=month)
+            .values_list('customer_id', 'fingerprint')
+        )
+
+    @staticmethod
+    def get_invoice_numbers(
+            year: int,
+            month: int,
+            customer_ids: list[int]
+    ) -> dict[int, int]:
+        return {
+            customer_id: int(number)
+            for customer_id, number in (
+                CustomerInvoice.objects
+                .filter(year=year, month=month, customer_id__in=customer_ids)
+                .values_list('customer_id', 'data__cnt__invoice_number')
+            )
+            if number is not None
+        }
+
+
+class RestoreCheckpointRepository:
+
+    @staticmethod
+    def get(name: str) -> RestoreCheckpoint | None:
+        return RestoreCheckpoint.objects.filter(name=name).first()
+
+    @staticmethod
+    def save(name: str, year: int, month: int, invoice_id: int):
+        RestoreCheckpoint.objects.update_or_create(
+            name=name,
+            defaults={'year': year, 'month': month, 'invoice_id': invoice_id}
+        )
+
+    @staticmethod
+    def delete(name: str):
+        RestoreCheckpoint.objects.filter(name=name).delete()
+
+
+class GenerationRunRepository:
+
+    @staticmethod
+    def create(
+            year: int,
+            month: int,
+            folder_id: str,
+            incremental: bool,
+            invoice_numbers: list[list[int]]
+    ) -> GenerationRun:
+        run = GenerationRun.objects.create(
+            year=year,
+            month=month,
+            folder_id=folder_id,
+            incremental=incremental
+        )
+        GenerationRunItem.objects.bulk_create([
+            GenerationRunItem(run=run, customer_id=customer_id, invoice_number=number)
+            for customer_id, number in invoice_numbers
+        ])
+        return run
+
+    @staticmethod
+    def start_attempt(run_id: int, attempt: int) -> GenerationRun | None:
+        # the run is locked and marked, so resuming the same attempt twice
+        # schedules its chunks only once
+        with transaction.atomic():
+            run = (
+                GenerationRun.objects
+                .select_for_update()
+                .filter(id=run_id, status=GenerationRun.Status.RUNNING)
+                .first()
+            )
+            if run is None or run.attempt != attempt:
+                return None
+            run.attempt += 1
+            run.save(update_fields=['attempt', 'updated_at'])
+            return run
+
+    @staticmethod
+    def get_unfinished_invoice_numbers(run_id: int) -> list[list[int]]:
+        return [
+            [customer_id, number]
+            for customer_id, number in (
+                GenerationRunItem.objects
+                .filter(run_id=run_id)
+                .exclude(stage=GenerationRunItem.Stage.PERSISTED)
+                .order_by('customer_id')
+                .values_list('customer_id', 'invoice_number')
+            )
+        ]
+
+    @staticmethod
+    def get_items(run_id: int, customer_ids: list[int]) -> dict[int, GenerationRunItem]:
+        return {
+            item.customer_id: item
+            for item in GenerationRunItem.objects.filter(
+                run_id=run_id,
+                customer_id__in=customer_ids
+            )
+        }
+
+    @staticmethod
+    def set_stage(
+            run_id: int,
+            customer_ids: list[int],
+            stage: str,
+            file_id: str | None = None
+    ):
+        fields = {'stage': stage, 'updated_at': timezone.now()}
+        if file_id is not None:
+            fields['file_id'] = file_id
+        GenerationRunItem.objects.filter(
+            run_id=run_id,
+            customer_id__in=customer_ids
+        ).update(**fields)
+
+    @staticmethod
+    def finish(run_id: int, metrics: dict):
+        GenerationRun.objects.filter(id=run_id).update(
+            status=GenerationRun.Status.FINISHED,
+            metrics=metrics,
+            updated_at=timezone.now()
+        )
+
+
+class DriveFileRepository:
+
+    @staticmethod
+    def get_page_token(root_folder_id: str) -> str | None:
+        return (
+            DriveSyncState.objects
+            .filter(root_folder_id=root_folder_id)
+            .values_list('page_token', flat=True)
+            .first()
         )
+
+    @staticmethod
+    def save_page_token(root_folder_id: str, page_token: str):
+        DriveSyncState.objects.update_or_create(
+            root_folder_id=root_folder_id,
+            defaults={'page_token': page_token}
+        )
+
+    def is_synced(self, root_folder_id: str) -> bool:
+        return self.get_page_token(root_folder_id) is not None
+
+    @staticmethod
+    def find_folder(parent_id: str, name: str) -> DriveFile | None:
+        return (
+            DriveFile.objects
+            .filter(
+                parent_id=parent_id,
+                name=name,
+                mime_type=DriveFile.FOLDER_MIME_TYPE
+            )
+            .order_by('id')
+            .first()
+        )
+
+    @staticmethod
+    def get_children(parent_id: str) -> dict[str, dict]:
+        index = {}
+        for file in (
+                DriveFile.objects
+                .filter(parent_id=parent_id)
+                .exclude(mime_type=DriveFile.FOLDER_MIME_TYPE)
+                .order_by('id')
+        ):
+            index.setdefault(file.name, file.dict())
+        return index
+
+    @staticmethod
+    def get_folder_ids() -> set[str]:
+        return set(
+            DriveFile.objects
+            .filter(mime_type=DriveFile.FOLDER_MIME_TYPE)
+            .values_list('file_id', flat=True)
+        )
+
+    @staticmethod
+    def upsert_many(files: list[dict]):
+        DriveFile.objects.bulk_create(
+            [
+                DriveFile(
+                    file_id=file['id'],
+                    parent_id=(file.get('parents') or [''])[0],
+                    name=file['name'],
+                    mime_type=file.get('mimeType', ''),
+                    md5_checksum=file.get('md5Checksum', ''),
+                    app_properties=file.get('appProperties') or {}
+                )
+                for file in files
+            ],
+            update_conflicts=True,
+            unique_fields=['file_id'],
+            update_fields=[
+                'parent_id',
+                'name',
+                'mime_type',
+                'md5_checksum',
+                'app_properties',
+                'updated_at'
+            ]
+        )
+
+    @staticmethod
+    def delete_many(file_ids: list[str]):
+        # the contents of removed folders go with them
+        file_ids = list(file_ids)
+        while file_ids:
+            children = list(
+                DriveFile.objects
+                .filter(parent_id__in=file_ids)
+                .values_list('file_id', flat=True)
+            )
+            DriveFile.objects.filter(file_id__in=file_ids).delete()
+            file_ids = children
+
+    def clear(self, root_folder_id: str):
+        # the root itself is not stored, this removes everything below it
+        self.delete_many([root_folder_id])
+        DriveSyncState.objects.filter(root_folder_id=root_folder_id).delete()
@@ -1,15 +1,22 @@
+import collections
 import datetime
+import hashlib
+import logging
 import os
 import io
+import itertools
 import json
 import shutil
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Iterator
 
 from django.conf import settings
-from django.db.models import QuerySet
 from docxtpl import DocxTemplate
 
 from .engine import (
-    DocxGenerator,
+    DocxRenderer,
+    CompiledDocxTemplate,
+    template_cache,
     Contractor,
     Address,
     BankAccount,
@@ -18,16 +25,52 @@ from .engine import (
     Item,
     Contact, Context
 )
-from .drive import GoogleDriveClient
-from .models import Work
+from .converters import PdfConverter, DrivePdfConverter
+from .drive import GoogleDriveClient, BatchResult, FOLDER_MIME_TYPE, md5_checksum
+from .metrics import RunMetrics
+from .sinks import OutputSink, DriveSink, AsyncDriveSink
+from .models import Customer, CustomerInvoice, GenerationRunItem
 from .repositories import (
     EmployersRepository,
     CustomersRepository,
     WorkRepository,
     CustomerInvoiceRepository,
-    EmployeesRepository
+    EmployeesRepository,
+    RestoreCheckpointRepository,
+    GenerationRunRepository,
+    DriveFileRepository
 )
 
+logger = logging.getLogger(__name__)
+
+
+def _collect_errors(results: dict[str, BatchResult]) -> list[BatchResult]:
+    errors = [result for result in results.values() if result.error is not None]
+    for result in errors:
+        logger.warning(f'Drive batch call {result.key} failed: {result.error}')
+    return errors
+
+
+def _download_template(
+        drive: GoogleDriveClient,
+        file_id: str,
+        revision: str
+) -> CompiledDocxTemplate:
+    def download() -> bytes:
+        with drive.download(file_id=file_id) as buffer:
+            return buffer.read()
+
+    return template_cache.get_or_add((file_id, revision), download)
+
+
+def _fingerprint(context: Context, template_revision: str) -> str:
+    payload = json.dumps(
+        [context.dict(), template_revision],
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
 
 class InitDatabaseService:
 
@@ -56,9 +99,8 @@ class InitDatabaseService:
     def init_db(self, key: str):
         repo = self.repositories[key]
         file_id = settings.GOOGLE_DRIVE_INIT_DATA[key]
-        buffer = self.drive.download(file_id=file_id)
-        data = json.loads(buffer.read().decode('utf-8'))
-        buffer.close()
+        with self.drive.download(file_id=file_id) as buffer:
+            data = json.load(buffer)
         repo.create_many(data)
 
     def clean_up(self, key: str):
@@ -99,9 +141,9 @@ class DownloadTemplateService:
     def download_templates(self):
         for filename, file_id in settings.GOOGLE_DRIVE_DOCX_TEMPLATES.items():
             output_path = f'{self._temp_dir}/{filename}'
-            buffer = self.drive.download(file_id=file_id)
-            doc = DocxTemplate(buffer)
-            doc.save(f'invoices/docx/{filename}.docx')
+            with self.drive.download(file_id=file_id) as buffer:
+                doc = DocxTemplate(buffer)
+                doc.save(f'invoices/docx/{filename}.docx')
 
     def _create_temp_dir(self):
         os.makedirs(self._temp_dir, exist_ok=True)
@@ -116,17 +158,34 @@ class GenerateCustomerInvoicesService:
             self,
             start_date: datetime.date,
             end_date: datetime.date,
-            drive: GoogleDriveClient,
+            drive: GoogleDriveClient | None,
             employer_repo: EmployersRepository,
             customer_repo: CustomersRepository,
             work_repo: WorkRepository,
             invoice_repo: CustomerInvoiceRepository,
-            last_invoice_number: str
+            last_invoice_number: str | None = None,
+            render_workers: int = 1,
+            folder_id: str | None = None,
+            invoice_numbers: dict[int, int] | None = None,
+            converter: PdfConverter | None = None,
+            skip_unchanged: bool = False,
+            incremental: bool = False,
+            metrics: RunMetrics | None = None,
+            run_repo: GenerationRunRepository | None = None,
+            run_id: int | None = None,
+            sink: OutputSink | None = None,
+            upload_workers: int = 1
     ):
         self.start_date = start_date
         self.end_date = end_date
 
         self.drive = drive
+        self.sink = sink or DriveSink(
+            drive=drive,
+            converter=converter,
+            skip_unchanged=skip_unchanged,
+            folder_id=folder_id
+        )
 
         self.employer_repo = employer_repo
         self.customer_repo = customer_repo
@@ -134,81 +193,289 @@ class GenerateCustomerInvoicesService:
         self.invoice_repo = invoice_repo
 
         self.last_invoice_number = last_invoice_number
+        self.render_workers = render_workers
+        self.upload_workers = upload_workers if self.sink.concurrent else 1
+
+        self.invoice_numbers = invoice_numbers
+        self.incremental = incremental
+        self.metrics = metrics or RunMetrics()
+
+        self.run_repo = run_repo
+        self.run_id = run_id
+
+        self.drive_errors: list[BatchResult] = []
+        self.skipped_customer_ids: list[int] = []
+        self.resumed_customer_ids: list[int] = []
+
+    def execute(self) -> list[CustomerInvoice]:
+        invoices = self.generate()
+        with self.metrics.stage('reconcile'):
+            self.invoice_repo.upsert_many(invoices)
+            self._checkpoint(
+                [invoice.customer_id for invoice in invoices] + self.skipped_customer_ids,
+                GenerationRunItem.Stage.PERSISTED
+            )
+        return invoices
+
+    def generate(self) -> list[CustomerInvoice]:
+        return list(self.iter_generate())
+
+    def iter_generate(self) -> Iterator[CustomerInvoice]:
+        customer_ids = None
+        if self.invoice_numbers is not None:
+            customer_ids = list(self.invoice_numbers)
+
+        with self.metrics.stage('query'):
+            employer = self.employer_repo.get()
+            daily_totals = self.work_repo.get_daily_totals(
+                self.start_date,
+                self.end_date,
+                customer_ids=customer_ids
+            )
+            customers = list(self.customer_repo.get_for_invoice(
+                self.start_date,
+                self.end_date,
+                customer_ids=customer_ids
+            ))
+
+            fingerprints = {}
+            if self.incremental:
+                fingerprints = self.invoice_repo.get_fingerprints(
+                    year=self.end_date.year,
+                    month=self.end_date.month
+                )
 
-    def execute(self):
-        employer = self.employer_repo.get()
-        works = self.work_repo.get_for_invoice(self.start_date, self.end_date)
-        customers = self.customer_repo.get_for_invoice(
-            self.start_date,
-            self.end_date,
-            works=works
-        )
+            items = {}
+            if self.run_id is not None:
+                items = self.run_repo.get_items(
+                    run_id=self.run_id,
+                    customer_ids=[customer.id for customer in customers]
+                )
 
-        folder_id = self.drive.create_folder_structure(
-            f'customers/{self.end_date.year}/{self.end_date.month:02d}'
-        )
+        with self.metrics.stage('prepare'):
+            template_revision = self.get_template_revision()
 
-        contractor = self._build_contractor(name=employer.name, data=employer.data)
+        with self.metrics.stage('build'):
+            contractor = self._build_contractor(name=employer.name, data=employer.data)
 
-        # FIXME
-        invoice_number = int(self.last_invoice_number)
+            contexts = []
+            for customer, number in self._number_customers(customers):
+                item = items.get(customer.id)
+                if item and item.reached(GenerationRunItem.Stage.PERSISTED):
+                    self.resumed_customer_ids.append(customer.id)
+                    continue
 
-        template = self.download_template()
+                client = self._build_client(data=customer.data)
+                content = self._build_content(
+                    daily_totals=daily_totals.get(customer.id, []),
+                    data=customer.data,
+                    invoice_number=number
+                )
+                context = Context(
+                    client=client,
+                    contractor=contractor,
+                    content=content
+                )
+                fingerprint = _fingerprint(context, template_revision)
+                if fingerprints.get(customer.id) == fingerprint:
+                    self.skipped_customer_ids.append(customer.id)
+                    continue
+                contexts.append((customer, context, fingerprint, item))
 
-        invoices_to_create = []
-        for number, customer in enumerate(customers, start=invoice_number+1):
-            client = self._build_client(data=customer.data)
-            content = self._build_content(
-                works=works,
-                data=customer.data,
-                invoice_number=number
-            )
-            filename = self._create_filename(customer.name)
+        self.metrics.count('invoices.skipped', len(self.skipped_customer_ids))
+        self.metrics.count('invoices.resumed', len(self.resumed_customer_ids))
 
-            context = Context(
-                client=client,
-                contractor=contractor,
-                content=content
+        if not contexts:
+            return
+
+        with self.metrics.stage('prepare'):
+            template = self.download_template(template_revision)
+            self.sink.open(self.create_folder_path(self.end_date))
+
+        renderer = DocxRenderer(
+            template=template,
+            workers=self.render_workers
+        )
+        documents = renderer.render_many(
+            context.dict() for _, context, _, _ in contexts
+        )
+
+        executor = None
+        if self.upload_workers > 1 and not isinstance(self.sink, AsyncDriveSink):
+            executor = ThreadPoolExecutor(
+                max_workers=self.upload_workers,
+                thread_name_prefix='invoice-upload'
             )
 
-            generator = DocxGenerator(data=context.dict(), template=template)
+        generated = 0
+        pending = collections.deque()
+        try:
+            for customer, context, fingerprint, item in contexts:
+                filename = self._create_filename(customer.name)
+
+                # waiting on the worker pool is what rendering costs the run
+                with self.metrics.sample('render', key=filename):
+                    document = next(documents)
+                self.metrics.count('documents.bytes', len(document))
+
+                pending.append((
+                    customer,
+                    context,
+                    fingerprint,
+                    item,
+                    self._submit(executor, filename, document, item)
+                ))
+                # documents are saved in parallel, results are taken in order
+                while len(pending) >= self.upload_workers:
+                    yield self._finish_document(*pending.popleft())
+                    generated += 1
+
+            while pending:
+                yield self._finish_document(*pending.popleft())
+                generated += 1
+
+            with self.metrics.stage('convert'):
+                self.drive_errors.extend(_collect_errors(self.sink.finish()))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            if isinstance(self.sink, AsyncDriveSink):
+                self.sink.shutdown()
+            # uploads only queue their mirror rows, a retried run must see them
+            if self.drive is not None:
+                self.drive.flush_mirror()
+
+        self.metrics.count('invoices.generated', generated)
+
+    def _submit(
+            self,
+            executor: ThreadPoolExecutor | None,
+            filename: str,
+            document: bytes,
+            item: GenerationRunItem | None
+    ) -> Future:
+        if isinstance(self.sink, AsyncDriveSink):
+            return self.sink.submit(self._save_document_async(filename, document, item))
+        if executor is not None:
+            return executor.submit(self._save_document, filename, document, item)
+
+        future = Future()
+        future.set_result(self._save_document(filename, document, item))
+        return future
+
+    def _save_document(
+            self,
+            filename: str,
+            document: bytes,
+            item: GenerationRunItem | None
+    ) -> tuple[str, bool, bool, Exception | None]:
+        uploaded = bool(item and item.reached(GenerationRunItem.Stage.UPLOADED))
+        converted = bool(item and item.reached(GenerationRunItem.Stage.CONVERTED))
+
+        with self.metrics.sample('upload', key=filename):
+            if uploaded:
+                # rendering is deterministic, so the uploaded file is current
+                file_id, changed = item.file_id, False
+            else:
+                file_id, changed = self.sink.save_document(filename, document)
+
+        try:
+            with self.metrics.sample('convert', key=filename):
+                if not converted and (
+                        changed or not self.sink.is_converted(filename, document)
+                ):
+                    self.sink.save_pdf(file_id, filename, document)
+        except Exception as e:
+            # raised once the upload is checkpointed, so a resume skips it
+            return file_id, uploaded, converted, e
 
-            with io.BytesIO() as buffer:
-                generator.generate(buffer)
-                file_id = self.drive.upload(
-                    file=buffer,
-                    filename=filename,
-                    parent_id=folder_id
-                )
-                self.drive.convert_docx_to_pdf(
-                    file_id=file_id,
-                    filename=filename,
-                    folder_id=folder_id
-                )
+        return file_id, uploaded, converted, None
 
-            invoice = self.invoice_repo.create_draft(
-                customer_id=customer.id,
-                data=context.dict()
+    async def _save_document_async(
+            self,
+            filename: str,
+            document: bytes,
+            item: GenerationRunItem | None
+    ) -> tuple[str, bool, bool, Exception | None]:
+        uploaded = bool(item and item.reached(GenerationRunItem.Stage.UPLOADED))
+        converted = bool(item and item.reached(GenerationRunItem.Stage.CONVERTED))
+
+        with self.metrics.sample('upload', key=filename):
+            if uploaded:
+                file_id, changed = item.file_id, False
+            else:
+                file_id, changed = await self.sink.save_document_async(filename, document)
+
+        try:
+            with self.metrics.sample('convert', key=filename):
+                if not converted and (
+                        changed or not await self.sink.is_converted_async(filename, document)
+                ):
+                    await self.sink.save_pdf_async(file_id, filename, document)
+        except Exception as e:
+            return file_id, uploaded, converted, e
+
+        return file_id, uploaded, converted, None
+
+    def _finish_document(
+            self,
+            customer: Customer,
+            context: Context,
+            fingerprint: str,
+            item: GenerationRunItem | None,
+            saved: Future
+    ) -> CustomerInvoice:
+        file_id, uploaded, converted, error = saved.result()
+
+        # checkpoints are written here, database connections stay on this thread
+        if not uploaded:
+            self._checkpoint(
+                [customer.id],
+                GenerationRunItem.Stage.UPLOADED,
+                file_id=file_id
             )
+        if error is not None:
+            raise error
+        if not converted:
+            self._checkpoint([customer.id], GenerationRunItem.Stage.CONVERTED)
 
-            invoices_to_create.append(invoice)
+        return self.invoice_repo.create_draft(
+            customer_id=customer.id,
+            year=self.end_date.year,
+            month=self.end_date.month,
+            data=context.dict(),
+            fingerprint=fingerprint
+        )
 
-        # TODO list all invoices for the month
-        invoices = self.invoice_repo.get_by_month(year=self.end_date.year, month=self.end_date.month)
-        mapper = {
-            invoice.customer_id: invoice
-            for invoice in invoices
-        }
-        # iterate over draft and split which ones has to be created and which one has to be updated
-        invoices_to_update = []
-        for invoice in invoices_to_create:
-            if invoice.customer_id in mapper:
-                invoice = mapper[invoice.customer_id]
-                invoices_to_update.append(invoice)
-                invoices_to_create.remove(invoice)
+    @staticmethod
+    def _read_local_template() -> bytes:
+        with open(settings.INVOICES_LOCAL_TEMPLATE_PATH, 'rb') as file:
+            return file.read()
+
+    def _checkpoint(self, customer_ids: list[int], stage: str, file_id: str | None = None):
+        if self.run_id is None or not customer_ids:
+            return
+        self.run_repo.set_stage(
+            run_id=self.run_id,
+            customer_ids=customer_ids,
+            stage=stage,
+            file_id=file_id
+        )
 
-        self.invoice_repo.create_many(invoices_to_create)
-        self.invoice_repo.update_many(invoices_to_update)
+    def _number_customers(self, customers: list[Customer]):
+        if self.invoice_numbers is not None:
+            for customer in customers:
+                yield customer, self.invoice_numbers[customer.id]
+            return
+
+        # FIXME
+        invoice_number = int(self.last_invoice_number)
+        for number, customer in enumerate(customers, start=invoice_number+1):
+            yield customer, number
+
+    @staticmethod
+    def create_folder_path(date: datetime.date) -> str:
+        return f'customers/{date.year}/{date.month:02d}'
 
     @staticmethod
     def _create_filename(name: str) -> str:
@@ -258,20 +525,12 @@ class GenerateCustomerInvoicesService:
     def _build_content(
             self,
             data: dict,
-            works: QuerySet[Work],
+            daily_totals: list[dict],
             invoice_number: int
     ) -> Content:
-        grouper = {}
-        for work in works:
-            if work.date not in grouper:
-                grouper[work.date] = {'price': work.total_price, 'hours': work.hours}
-            else:
-                grouper[work.date]['price'] += work.total_price
-                grouper[work.date]['hours'] += work.hours
-
         items = [
-            Item(date=date, price=values['price'], hours=values['hours'])
-            for date, values in grouper.items()
+            Item(date=row['date'], price=row['total_price'], hours=row['total_hours'])
+            for row in daily_totals
         ]
 
         return Content(
@@ -285,46 +544,152 @@ class GenerateCustomerInvoicesService:
             note=data['note'],
         )
 
-    def download_template(self) -> io.BytesIO:
+    def get_template_revision(self) -> str:
+        if self.drive is None:
+            return md5_checksum(self._read_local_template())
+
         template_file_id = settings.GOOGLE_DRIVE_DOCX_TEMPLATES['customers']
-        return self.drive.download(file_id=template_file_id)
+        return self.drive.get_md5_checksum(file_id=template_file_id)
+
+    def download_template(self, revision: str) -> CompiledDocxTemplate:
+        if self.drive is None:
+            return template_cache.get_or_add(
+                (settings.INVOICES_LOCAL_TEMPLATE_PATH, revision),
+                self._read_local_template
+            )
+
+        return _download_template(
+            drive=self.drive,
+            file_id=settings.GOOGLE_DRIVE_DOCX_TEMPLATES['customers'],
+            revision=revision
+        )
 
 
 class RestoreCustomerInvoicesService:
 
+    checkpoint_name = 'customer_invoices'
+
     def __init__(
             self,
             drive: GoogleDriveClient,
             repo: CustomerInvoiceRepository,
+            checkpoint_repo: RestoreCheckpointRepository,
+            converter: PdfConverter | None = None,
+            render_workers: int = 1,
+            chunk_size: int = 100,
+            resume: bool = False,
+            upload_workers: int = 1
     ):
         self.drive = drive
         self.repo = repo
-        self.template = settings.BASE_DIR / settings.CUSTOMER_TEMPLATE_PATH
+        self.checkpoint_repo = checkpoint_repo
+        self.converter = converter or DrivePdfConverter(drive)
+
+        self.render_workers = render_workers
+        self.upload_workers = upload_workers
+        self.chunk_size = chunk_size
+        self.resume = resume
+
+        self.restored = 0
+        self.drive_errors: list[BatchResult] = []
+
+        self._folder_ids: dict[tuple[int, int], str] = {}
 
     def execute(self):
+        checkpoint = None
+        if self.resume:
+            checkpoint = self.checkpoint_repo.get(self.checkpoint_name)
+        else:
+            self.checkpoint_repo.delete(self.checkpoint_name)
 
-        invoices = self.repo.get_all()
+        template_file_id = settings.GOOGLE_DRIVE_DOCX_TEMPLATES['customers']
+        template = _download_template(
+            drive=self.drive,
+            file_id=template_file_id,
+            revision=self.drive.get_md5_checksum(file_id=template_file_id)
+        )
+        renderer = DocxRenderer(template=template, workers=self.render_workers)
 
-        for invoice in invoices:
-            generator = DocxGenerator(data=invoice.data, template=self.template)
+        invoices = self.repo.iter_for_restore(
+            after=checkpoint,
+            chunk_size=self.chunk_size
+        )
+        with ThreadPoolExecutor(
+                max_workers=self.upload_workers,
+                thread_name_prefix='invoice-upload'
+        ) as executor:
+            try:
+                while chunk := list(itertools.islice(invoices, self.chunk_size)):
+                    try:
+                        self._restore_chunk(renderer, executor, chunk)
+                    finally:
+                        # temporary copies are deleted with every chunk, an
+                        # interrupted restore leaves none of them behind
+                        self.drive_errors.extend(_collect_errors(self.converter.finish()))
+                    self.drive.flush_mirror()
+
+                    last = chunk[-1]
+                    self.checkpoint_repo.save(
+                        name=self.checkpoint_name,
+                        year=last.year,
+                        month=last.month,
+                        invoice_id=last.id
+                    )
+            finally:
+                self.drive.flush_mirror()
+
+        self.checkpoint_repo.delete(self.checkpoint_name)
+
+    def _restore_chunk(
+            self,
+            renderer: DocxRenderer,
+            executor: ThreadPoolExecutor,
+            invoices: list[CustomerInvoice]
+    ):
+        # documents are rendered in the worker pool while earlier ones upload
+        documents = renderer.render_many(invoice.data for invoice in invoices)
+
+        futures = []
+        try:
+            for invoice, document in zip(invoices, documents):
+                futures.append(executor.submit(
+                    self._restore_invoice,
+                    filename=self._create_filename(invoice.customer.name),
+                    folder_id=self._get_folder_id(invoice.year, invoice.month),
+                    document=document
+                ))
+
+            # the chunk is only checkpointed once all of its uploads are done
+            for future in futures:
+                future.result()
+                self.restored += 1
+        finally:
+            # the uploads still running after a failure convert as well, the
+            # chunk is finished once their temporary copies are known
+            wait(futures)
+
+    def _restore_invoice(self, filename: str, folder_id: str, document: bytes):
+        with io.BytesIO(document) as buffer:
+            file_id = self.drive.upload(
+                file=buffer,
+                filename=filename,
+                parent_id=folder_id
+            )
+        self.converter.convert(
+            file_id=file_id,
+            filename=filename,
+            content=document,
+            folder_id=folder_id
+        )
 
-            with io.BytesIO() as buffer:
-                generator.generate(buffer)
-                filename = self._create_filename(invoice.customer.name)
-                backup_filepath = self._create_backup_folder_structure(
-                    data=invoice.data,
-                )
-                folder_id = self.drive.create_folder_structure(backup_filepath)
-                file_id = self.drive.upload(
-                    file=buffer,
-                    filename=filename,
-                    parent_id=folder_id
-                )
-                self.drive.convert_docx_to_pdf(
-                    file_id=file_id,
-                    filename=filename,
-                    folder_id=folder_id
-                )
+    def _get_folder_id(self, year: int, month: int) -> str:
+        if (year, month) not in self._folder_ids:
+            folder_id = self.drive.create_folder_structure(
+                self._create_backup_folder_path(year, month)
+            )
+            self.drive.index_folder(folder_id)
+            self._folder_ids[(year, month)] = folder_id
+        return self._folder_ids[(year, month)]
 
     @staticmethod
     def _create_filename(name: str) -> str:
@@ -337,9 +702,102 @@ class RestoreCustomerInvoicesService:
         return f'{customer_name}.docx'
 
     @staticmethod
-    def _create_backup_folder_structure(data: dict) -> str:
-        issue_date = data.get('cnt', {}).get('issue_date')
-        date = datetime.datetime.strptime(issue_date, '%d.%m.%Y')
-        year = date.strftime('%Y')
-        month = date.strftime('%m')
-        return f'backup/customers/{year}/{month}'
+    def _create_backup_folder_path(year: int, month: int) -> str:
+        return f'backup/customers/{year}/{month:02d}'
+
+
+class SyncDriveMirrorService:
+
+    def __init__(
+            self,
+            drive: GoogleDriveClient,
+            repo: DriveFileRepository,
+            full: bool = False
+    ):
+        self.drive = drive
+        self.repo = repo
+        self.full = full
+        self.root_folder_id = drive.root_folder_id
+
+        self.updated = 0
+        self.removed = 0
+
+    def execute(self):
+        if self.full:
+            self.repo.clear(self.root_folder_id)
+
+        page_token = self.repo.get_page_token(self.root_folder_id)
+        if page_token is None:
+            self.crawl()
+            return
+
+        while True:
+            response = self.drive.list_changes(page_token)
+            self.apply_changes(response.get('changes', []))
+
+            # saved per page, an interrupted sync continues from here
+            page_token = response.get('nextPageToken') or response['newStartPageToken']
+            self.repo.save_page_token(self.root_folder_id, page_token)
+            if 'newStartPageToken' in response:
+                break
+
+    def crawl(self):
+        # changes made while the tree is listed are replayed by the next sync
+        page_token = self.drive.get_start_page_token()
+        self.repo.clear(self.root_folder_id)
+        self._crawl_folders([self.root_folder_id])
+        self.repo.save_page_token(self.root_folder_id, page_token)
+
+    def _crawl_folders(self, folder_ids: list[str]):
+        folder_ids = collections.deque(folder_ids)
+        while folder_ids:
+            files = self.drive.list_folder(folder_ids.popleft())
+            self.repo.upsert_many(files)
+            self.updated += len(files)
+            folder_ids.extend(
+                file['id'] for file in files if file.get('mimeType') == FOLDER_MIME_TYPE
+            )
+
+    def apply_changes(self, changes: list[dict]):
+        removed = []
+        pending = []
+        for change in changes:
+            file = change.get('file')
+            if change.get('removed') or not file or file.get('trashed'):
+                removed.append(change['fileId'])
+            else:
+                pending.append(file)
+
+        # the changes feed covers the whole drive, only files below the
+        # root are kept, a folder may arrive in the same page as its files
+        known_folder_ids = self.repo.get_folder_ids() | {self.root_folder_id}
+        folder_ids = set(known_folder_ids)
+        inside = []
+        while True:
+            entered = [
+                file for file in pending
+                if (file.get('parents') or [''])[0] in folder_ids
+            ]
+            if not entered:
+                break
+            inside.extend(entered)
+            entered_ids = {file['id'] for file in entered}
+            pending = [file for file in pending if file['id'] not in entered_ids]
+            folder_ids.update(
+                file['id'] for file in entered if file.get('mimeType') == FOLDER_MIME_TYPE
+            )
+
+        # files moved out of the tree are dropped like removed ones
+        removed.extend(file['id'] for file in pending)
+        if removed:
+            self.repo.delete_many(removed)
+            self.removed += len(removed)
+        if inside:
+            self.repo.upsert_many(inside)
+            self.updated += len(inside)
+
+        # folders moved in from elsewhere bring contents the feed does not list
+        self._crawl_folders([
+            file['id'] for file in inside
+            if file.get('mimeType') == FOLDER_MIME_TYPE and file['id'] not in known_folder_ids
+        ])
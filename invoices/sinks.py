@@ -0,0 +1,282 @@
+import asyncio
+import io
+import logging
+import os
+import zipfile
+from collections.abc import Coroutine
+from concurrent.futures import Future
+
+from .async_drive import AsyncGoogleDriveClient, EventLoopThread
+from .converters import PdfConverter, DrivePdfConverter, LibreOfficePool
+from .drive import GoogleDriveClient, BatchResult, md5_checksum
+
+logger = logging.getLogger(__name__)
+
+
+class OutputSink:
+
+    # whether documents may be saved from several threads at once
+    concurrent = False
+
+    def open(self, path: str):
+        raise NotImplementedError
+
+    def save_document(self, filename: str, content: bytes) -> tuple[str, bool]:
+        raise NotImplementedError
+
+    def is_converted(self, filename: str, content: bytes) -> bool:
+        return False
+
+    def save_pdf(self, file_id: str, filename: str, content: bytes) -> str:
+        raise NotImplementedError
+
+    def finish(self) -> dict[str, BatchResult]:
+        return {}
+
+    @staticmethod
+    def create_pdf_filename(filename: str) -> str:
+        return PdfConverter.create_pdf_filename(filename)
+
+
+class DriveSink(OutputSink):
+
+    concurrent = True
+
+    def __init__(
+            self,
+            drive: GoogleDriveClient,
+            converter: PdfConverter | None = None,
+            skip_unchanged: bool = False,
+            folder_id: str | None = None
+    ):
+        self.drive = drive
+        self.converter = converter or DrivePdfConverter(drive)
+        self.skip_unchanged = skip_unchanged
+        self.folder_id = folder_id
+
+    def open(self, path: str):
+        self.folder_id = self.folder_id or self.drive.create_folder_structure(path)
+        # existing DOCX/PDF files are resolved from one listing of the folder
+        self.drive.index_folder(self.folder_id)
+
+    def save_document(self, filename: str, content: bytes) -> tuple[str, bool]:
+        with io.BytesIO(content) as buffer:
+            if self.skip_unchanged:
+                return self.drive.upload_if_changed(
+                    file=buffer,
+                    filename=filename,
+                    parent_id=self.folder_id
+                )
+            file_id = self.drive.upload(
+                file=buffer,
+                filename=filename,
+                parent_id=self.folder_id
+            )
+            return file_id, True
+
+    def is_converted(self, filename: str, content: bytes) -> bool:
+        return self.drive.is_converted(
+            pdf_name=self.create_pdf_filename(filename),
+            parent_id=self.folder_id,
+            source_md5=md5_checksum(content)
+        )
+
+    def save_pdf(self, file_id: str, filename: str, content: bytes) -> str:
+        return self.converter.convert(
+            file_id=file_id,
+            filename=filename,
+            content=content,
+            folder_id=self.folder_id
+        )
+
+    def finish(self) -> dict[str, BatchResult]:
+        return self.converter.finish()
+
+
+class AsyncDriveSink(OutputSink):
+
+    concurrent = True
+
+    def __init__(
+            self,
+            drive: AsyncGoogleDriveClient,
+            pool: LibreOfficePool | None = None,
+            skip_unchanged: bool = False,
+            folder_id: str | None = None
+    ):
+        self.drive = drive
+        self.pool = pool
+        self.skip_unchanged = skip_unchanged
+        self.folder_id = folder_id
+
+        self._runner: EventLoopThread | None = None
+
+    @property
+    def runner(self) -> EventLoopThread:
+        # the client lives on its own event loop, documents are submitted to
+        # it so many uploads can be in flight without a thread each
+        if self._runner is None:
+            self._runner = EventLoopThread()
+        return self._runner
+
+    def submit(self, coro: Coroutine) -> Future:
+        return self.runner.submit(coro)
+
+    async def open_async(self, path: str):
+        self.folder_id = self.folder_id or await self.drive.create_folder_structure(path)
+        await self.drive.index_folder(self.folder_id)
+
+    def open(self, path: str):
+        self.runner.run(self.open_async(path))
+
+    async def save_document_async(self, filename: str, content: bytes) -> tuple[str, bool]:
+        if self.skip_unchanged:
+            return await self.drive.upload_if_changed(
+                filename=filename,
+                content=content,
+                parent_id=self.folder_id
+            )
+        file_id = await self.drive.upload(
+            filename=filename,
+            content=content,
+            parent_id=self.folder_id
+        )
+        return file_id, True
+
+    def save_document(self, filename: str, content: bytes) -> tuple[str, bool]:
+        return self.runner.run(self.save_document_async(filename, content))
+
+    async def is_converted_async(self, filename: str, content: bytes) -> bool:
+        return await self.drive.is_converted(
+            pdf_name=self.create_pdf_filename(filename),
+            parent_id=self.folder_id,
+            source_md5=md5_checksum(content)
+        )
+
+    def is_converted(self, filename: str, content: bytes) -> bool:
+        return self.runner.run(self.is_converted_async(filename, content))
+
+    async def save_pdf_async(self, file_id: str, filename: str, content: bytes) -> str:
+        app_properties = PdfConverter.create_app_properties(content)
+        if self.pool is None:
+            return await self.drive.convert_docx_to_pdf(
+                file_id=file_id,
+                filename=filename,
+                folder_id=self.folder_id,
+                cleanup=False,
+                app_properties=app_properties
+            )
+
+        pdf_content = await asyncio.to_thread(self.pool.convert, content)
+        return await self.drive.upload(
+            filename=self.create_pdf_filename(filename),
+            content=pdf_content,
+            parent_id=self.folder_id,
+            mimetype='application/pdf',
+            app_properties=app_properties
+        )
+
+    def save_pdf(self, file_id: str, filename: str, content: bytes) -> str:
+        return self.runner.run(self.save_pdf_async(file_id, filename, content))
+
+    def finish(self) -> dict[str, BatchResult]:
+        return self.runner.run(self.drive.cleanup_temporary_files())
+
+    def shutdown(self):
+        if self._runner is None:
+            return
+        self._runner.run(self.drive.aclose())
+        self._runner.close()
+        self._runner = None
+
+
+class LocalDirectorySink(OutputSink):
+
+    def __init__(self, root: str, pool: LibreOfficePool | None = None):
+        self.root = root
+        self.pool = pool
+        self.folder = root
+
+    def open(self, path: str):
+        self.folder = os.path.join(self.root, path)
+        os.makedirs(self.folder, exist_ok=True)
+
+    def save_document(self, filename: str, content: bytes) -> tuple[str, bool]:
+        path = os.path.join(self.folder, filename)
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                if md5_checksum(file.read()) == md5_checksum(content):
+                    return path, False
+
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path, True
+
+    def is_converted(self, filename: str, content: bytes) -> bool:
+        path = os.path.join(self.folder, filename)
+        pdf_path = os.path.join(self.folder, self.create_pdf_filename(filename))
+        return (
+            os.path.exists(pdf_path)
+            and os.path.getmtime(pdf_path) >= os.path.getmtime(path)
+        )
+
+    def save_pdf(self, file_id: str, filename: str, content: bytes) -> str:
+        if self.pool is None:
+            return ''
+
+        path = os.path.join(self.folder, self.create_pdf_filename(filename))
+        with open(path, 'wb') as file:
+            file.write(self.pool.convert(content))
+        return path
+
+
+class _ZipStream(io.RawIOBase):
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+class ZipSink(OutputSink):
+
+    def __init__(self, pool: LibreOfficePool | None = None):
+        self.pool = pool
+        self.prefix = ''
+
+        # the stream is not seekable, so entries are written with data
+        # descriptors and can be sent as soon as they are added
+        self._stream = _ZipStream()
+        self._zip = zipfile.ZipFile(self._stream, 'w', zipfile.ZIP_DEFLATED)
+
+    def open(self, path: str):
+        self.prefix = path
+
+    def save_document(self, filename: str, content: bytes) -> tuple[str, bool]:
+        name = f'{self.prefix}/{filename}'
+        self._zip.writestr(name, content)
+        return name, True
+
+    def save_pdf(self, file_id: str, filename: str, content: bytes) -> str:
+        if self.pool is None:
+            return ''
+
+        name = f'{self.prefix}/{self.create_pdf_filename(filename)}'
+        self._zip.writestr(name, self.pool.convert(content))
+        return name
+
+    def drain(self) -> bytes:
+        return self._stream.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self.drain()
@@ -1,19 +1,31 @@
 import datetime
+import json
+import shutil
 
-from celery import shared_task
+from celery import shared_task, chord
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from googleapiclient.errors import HttpError
 
 from invoices.repositories import (
     EmployersRepository,
     CustomersRepository,
     WorkRepository,
-    CustomerInvoiceRepository
+    CustomerInvoiceRepository,
+    RestoreCheckpointRepository,
+    GenerationRunRepository
 )
 from invoices.services import (
     GenerateCustomerInvoicesService,
-    RestoreCustomerInvoicesService
+    RestoreCustomerInvoicesService,
+    SyncDriveMirrorService
 )
-from invoices.drive import GoogleDriveClient
+from invoices.converters import get_pdf_converter, find_libreoffice_pool, get_libreoffice_pool
+from invoices.drive import GoogleDriveClient, get_async_drive_client, get_drive_client
+from invoices.metrics import RunMetrics
+from invoices.models import GenerationRun, GenerationRunItem
+from invoices.sinks import AsyncDriveSink, LocalDirectorySink
+from invoices.utils import get_month_range
 
 service_mapper = {
     'customer': GenerateCustomerInvoicesService,
@@ -21,42 +33,328 @@ service_mapper = {
 
 logger = get_task_logger(__name__)
 
+
+def _sync_drive_mirror(drive: GoogleDriveClient, full: bool = False):
+    if drive.mirror is None:
+        return
+
+    service = SyncDriveMirrorService(drive=drive, repo=drive.mirror, full=full)
+    service.execute()
+    logger.info(
+        f'Synced Drive mirror, updated: {service.updated}, '
+        f'removed: {service.removed}, full: {full}'
+    )
+
+
 @shared_task
-def generate_customer_invoices(month: datetime.date, last_invoice_number: str):
+def sync_drive_mirror(full: bool = False):
+    _sync_drive_mirror(get_drive_client(), full=full)
 
-    drive = GoogleDriveClient()
 
-    employer_repo = EmployersRepository()
+@shared_task
+def generate_customer_invoices(month: datetime.date, last_invoice_number: str):
+
+    drive = get_drive_client()
+    # chunks resolve folders and existing files from the mirror
+    _sync_drive_mirror(drive)
     customer_repo = CustomersRepository()
-    work_repo = WorkRepository()
+
+    start_date, end_date = get_month_range(month)
+
+    folder_id = drive.create_folder_structure(
+        GenerateCustomerInvoicesService.create_folder_path(end_date)
+    )
+
+    customer_ids = customer_repo.get_ids_for_invoice(start_date, end_date)
+    invoice_numbers = [
+        [customer_id, number]
+        for number, customer_id in enumerate(
+            customer_ids, start=int(last_invoice_number) + 1
+        )
+    ]
+
+    _schedule_chunks(
+        month=month,
+        folder_id=folder_id,
+        invoice_numbers=invoice_numbers,
+        incremental=settings.INVOICES_INCREMENTAL_REGENERATION
+    )
+
+
+@shared_task
+def regenerate_customer_invoices(month: datetime.date, customer_ids: list[int]):
+
+    drive = get_drive_client()
+    _sync_drive_mirror(drive)
     invoice_repo = CustomerInvoiceRepository()
 
-    start_date = month.replace(day=1)
-    end_date = (
-        month.replace(month=month.month % 12 + 1, day=1)
-        - datetime.timedelta(days=1)
+    start_date, end_date = get_month_range(month)
+
+    # regenerated invoices keep the numbers they were issued with
+    numbers = invoice_repo.get_invoice_numbers(
+        year=end_date.year,
+        month=end_date.month,
+        customer_ids=customer_ids
+    )
+    missing = set(customer_ids) - set(numbers)
+    if missing:
+        logger.warning(
+            f'Customers {sorted(missing)} have no invoice to regenerate, '
+            f'start_date: {start_date}, end_date: {end_date}'
+        )
+
+    folder_id = drive.create_folder_structure(
+        GenerateCustomerInvoicesService.create_folder_path(end_date)
+    )
+
+    _schedule_chunks(
+        month=month,
+        folder_id=folder_id,
+        invoice_numbers=sorted(
+            [customer_id, number] for customer_id, number in numbers.items()
+        ),
+        incremental=False
     )
 
+
+def _schedule_chunks(
+        month: datetime.date,
+        folder_id: str,
+        invoice_numbers: list[list[int]],
+        incremental: bool
+):
+    start_date, end_date = get_month_range(month)
+
+    if not invoice_numbers:
+        logger.info(
+            f'No customer invoices to generate, '
+            f'start_date: {start_date}, end_date: {end_date}'
+        )
+        return
+
+    run = GenerationRunRepository().create(
+        year=end_date.year,
+        month=end_date.month,
+        folder_id=folder_id,
+        incremental=incremental,
+        invoice_numbers=invoice_numbers
+    )
+    _schedule_run(run=run, invoice_numbers=invoice_numbers)
+
+
+def _schedule_run(run: GenerationRun, invoice_numbers: list[list[int]]):
+    month = datetime.date(run.year, run.month, 1)
+
+    chunk_size = settings.INVOICES_TASK_CHUNK_SIZE
+    chunks = [
+        invoice_numbers[i:i + chunk_size]
+        for i in range(0, len(invoice_numbers), chunk_size)
+    ]
+
+    chord(
+        generate_customer_invoices_chunk.s(
+            month=month,
+            folder_id=run.folder_id,
+            invoice_numbers=chunk,
+            incremental=run.incremental,
+            run_id=run.id
+        )
+        for chunk in chunks
+    )(reconcile_customer_invoices.s(month=month, run_id=run.id))
+
+    logger.info(
+        f'Scheduled {len(invoice_numbers)} customer invoices in {len(chunks)} chunks, '
+        f'run: {run.id}, month: {run.year}/{run.month:02d}'
+    )
+
+
+@shared_task
+def resume_generation_run(run_id: int, attempt: int):
+    run_repo = GenerationRunRepository()
+    run = run_repo.start_attempt(run_id=run_id, attempt=attempt)
+    if run is None:
+        logger.info(f'Run {run_id} is finished or attempt {attempt} was resumed already')
+        return
+
+    # customers resume from their last completed stage in the chunk task
+    invoice_numbers = run_repo.get_unfinished_invoice_numbers(run_id)
+    if not invoice_numbers:
+        logger.info(f'Run {run_id} has nothing left to resume')
+        return
+
+    _schedule_run(run=run, invoice_numbers=invoice_numbers)
+
+
+@shared_task(
+    autoretry_for=(HttpError,),
+    retry_backoff=True,
+    max_retries=5
+)
+def generate_customer_invoices_chunk(
+        month: datetime.date,
+        folder_id: str,
+        invoice_numbers: list[list[int]],
+        incremental: bool = True,
+        run_id: int | None = None
+) -> dict:
+
+    metrics = RunMetrics()
+    drive = get_drive_client(metrics=metrics)
+
+    start_date, end_date = get_month_range(month)
+
+    sink = None
+    upload_workers = settings.INVOICES_UPLOAD_WORKERS
+    async_drive = get_async_drive_client(metrics=metrics)
+    if async_drive is not None:
+        pool = None
+        if (
+                settings.INVOICES_PDF_CONVERTER == 'libreoffice'
+                and shutil.which(settings.LIBREOFFICE_BINARY)
+        ):
+            pool = get_libreoffice_pool()
+        sink = AsyncDriveSink(
+            drive=async_drive,
+            pool=pool,
+            skip_unchanged=settings.INVOICES_SKIP_UNCHANGED_UPLOADS,
+            folder_id=folder_id
+        )
+        upload_workers = settings.GOOGLE_DRIVE_ASYNC_CONCURRENCY
+
     service = GenerateCustomerInvoicesService(
         start_date=start_date,
         end_date=end_date,
         drive=drive,
-        employer_repo=employer_repo,
-        customer_repo=customer_repo,
-        work_repo=work_repo,
-        invoice_repo=invoice_repo,
-        last_invoice_number=last_invoice_number
+        employer_repo=EmployersRepository(),
+        customer_repo=CustomersRepository(),
+        work_repo=WorkRepository(),
+        invoice_repo=CustomerInvoiceRepository(),
+        render_workers=settings.INVOICES_RENDER_WORKERS,
+        folder_id=folder_id,
+        invoice_numbers=dict(invoice_numbers),
+        converter=get_pdf_converter(drive),
+        skip_unchanged=settings.INVOICES_SKIP_UNCHANGED_UPLOADS,
+        incremental=incremental,
+        metrics=metrics,
+        run_repo=GenerationRunRepository(),
+        run_id=run_id,
+        sink=sink,
+        upload_workers=upload_workers
     )
-    service.execute()
+    invoices = service.generate()
     logger.info(
-        f'Generated customer invoices, '
-        f'start_date: {start_date}, end_date: {end_date}'
+        f'Generated {len(invoices)} customer invoices, '
+        f'skipped {len(service.skipped_customer_ids)} unchanged, '
+        f'{len(service.resumed_customer_ids)} already persisted, '
+        f'start_date: {start_date}, end_date: {end_date}, '
+        f'drive errors: {len(service.drive_errors)}'
     )
+    return {
+        'invoices': [
+            {
+                'customer_id': invoice.customer_id,
+                'data': invoice.data,
+                'fingerprint': invoice.fingerprint
+            }
+            for invoice in invoices
+        ],
+        'skipped': service.skipped_customer_ids,
+        'metrics': metrics.dict()
+    }
+
 
 @shared_task
-def restore_customer_invoices():
-    drive = GoogleDriveClient()
+def reconcile_customer_invoices(
+        results: list[dict],
+        month: datetime.date,
+        run_id: int | None = None
+):
     repo = CustomerInvoiceRepository()
-    service = RestoreCustomerInvoicesService(drive=drive, repo=repo)
+
+    _, end_date = get_month_range(month)
+
+    metrics = RunMetrics()
+    for result in results:
+        metrics.merge(result['metrics'])
+
+    with metrics.stage('reconcile'):
+        invoices = [
+            repo.create_draft(
+                customer_id=item['customer_id'],
+                year=end_date.year,
+                month=end_date.month,
+                data=item['data'],
+                fingerprint=item['fingerprint']
+            )
+            for result in results
+            for item in result['invoices']
+        ]
+        repo.upsert_many(invoices)
+
+    summary = metrics.summary()
+    if run_id is not None:
+        run_repo = GenerationRunRepository()
+        run_repo.set_stage(
+            run_id=run_id,
+            customer_ids=[invoice.customer_id for invoice in invoices] + [
+                customer_id
+                for result in results
+                for customer_id in result['skipped']
+            ],
+            stage=GenerationRunItem.Stage.PERSISTED
+        )
+        run_repo.finish(run_id=run_id, metrics=summary)
+
+    logger.info(
+        f'Reconciled {len(invoices)} customer invoices, end_date: {end_date}, '
+        f'run: {run_id}, metrics: {json.dumps(summary)}'
+    )
+
+
+@shared_task
+def export_customer_invoices(month: datetime.date, last_invoice_number: str):
+    start_date, end_date = get_month_range(month)
+
+    service = GenerateCustomerInvoicesService(
+        start_date=start_date,
+        end_date=end_date,
+        drive=None,
+        employer_repo=EmployersRepository(),
+        customer_repo=CustomersRepository(),
+        work_repo=WorkRepository(),
+        invoice_repo=CustomerInvoiceRepository(),
+        last_invoice_number=last_invoice_number,
+        render_workers=settings.INVOICES_RENDER_WORKERS,
+        sink=LocalDirectorySink(
+            root=settings.INVOICES_LOCAL_OUTPUT_DIR,
+            pool=find_libreoffice_pool()
+        )
+    )
+    # a local export is a preview and does not replace the stored invoices
+    invoices = service.generate()
+    logger.info(
+        f'Exported {len(invoices)} customer invoices to '
+        f'{settings.INVOICES_LOCAL_OUTPUT_DIR}, '
+        f'start_date: {start_date}, end_date: {end_date}'
+    )
+
+
+@shared_task
+def restore_customer_invoices(resume: bool = False):
+    drive = get_drive_client()
+    _sync_drive_mirror(drive)
+    service = RestoreCustomerInvoicesService(
+        drive=drive,
+        repo=CustomerInvoiceRepository(),
+        checkpoint_repo=RestoreCheckpointRepository(),
+        converter=get_pdf_converter(drive),
+        render_workers=settings.INVOICES_RENDER_WORKERS,
+        chunk_size=settings.INVOICES_RESTORE_CHUNK_SIZE,
+        resume=resume,
+        upload_workers=settings.INVOICES_UPLOAD_WORKERS
+    )
     service.execute()
-    logger.info('Invoices restored from Google Drive to database.')
+    logger.info(
+        f'Restored {service.restored} invoices from database to Google Drive, '
+        f'resume: {resume}, drive errors: {len(service.drive_errors)}'
+    )
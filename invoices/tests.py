@@ -1,3 +1,805 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import email
+import hashlib
+import importlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import httplib2
+from django.apps import apps as django_apps
+from django.test import SimpleTestCase, TestCase, override_settings
+from docx import Document
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.errors import HttpError
+from lxml import etree
+
+from .async_drive import AsyncGoogleDriveClient
+from .drive import FOLDER_MIME_TYPE, call_with_retries, get_async_drive_client
+from .engine import (
+    CompiledDocxTemplate,
+    FastDocxTemplate,
+    DocxGenerator,
+    Address,
+    BankAccount,
+    Client,
+    Contact,
+    Content,
+    Context,
+    Contractor,
+    Item,
+)
+from .models import (
+    Customer,
+    CustomerInvoice,
+    DriveFile,
+    Employee,
+    Employer,
+    GenerationRunItem,
+    Work,
+)
+from .repositories import (
+    CustomerInvoiceRepository,
+    CustomersRepository,
+    DriveFileRepository,
+    EmployersRepository,
+    GenerationRunRepository,
+    WorkRepository,
+)
+from .services import GenerateCustomerInvoicesService, SyncDriveMirrorService
+from .sinks import OutputSink
+from .tasks import reconcile_customer_invoices, resume_generation_run
+from .utils import get_month_range
+
+
+def create_template() -> bytes:
+    document = Document()
+    document.add_paragraph('Rechnung {{ cnt.invoice_number }} vom {{ cnt.issue_date }}')
+    document.add_paragraph('{{ cl.name }}, {{ cl.a.street }}, {{ cl.a.code }} {{ cl.a.city }}')
+    document.add_paragraph('{{ co.company }} {{ co.name }} {{ co.number }}')
+    document.add_paragraph('{{ co.bank_account.iban }} {{ co.contact.email }}')
+
+    table = document.add_table(rows=3, cols=3)
+    table.rows[0].cells[0].text = '{%tr for item in cnt.items_ %}'
+    table.rows[1].cells[0].text = '{{ item.date }}'
+    table.rows[1].cells[1].text = '{{ item.hours }}'
+    table.rows[1].cells[2].text = '{{ item.total }}'
+    table.rows[2].cells[0].text = '{%tr endfor %}'
+
+    document.add_paragraph(
+        'Netto {{ cnt.netto }} {% if cnt.vat %}MwSt {{ cnt.tax }}{% endif %} '
+        'Brutto {{ cnt.brutto }}'
+    )
+    document.add_paragraph('{{ cnt.note }}')
+
+    section = document.sections[0]
+    section.header.paragraphs[0].text = 'Rechnung {{ cnt.month }} {{ cnt.year }}'
+    section.footer.paragraphs[0].text = '{{ co.company }}'
+
+    with io.BytesIO() as output:
+        document.save(output)
+        return output.getvalue()
+
+
+def create_context(vat: bool = False) -> Context:
+    address = Address(street_name='Hauptstr. 1', city='Berlin', zip_code='10115')
+    return Context(
+        client=Client(name='Müller GmbH', address=address),
+        contractor=Contractor(
+            company='Cleaning',
+            name='Jan',
+            number='St.Nr. 1 USt-Id.Nr: DE1',
+            address=address,
+            bank_account=BankAccount(bank_name='Bank', iban='DE00', bic='BIC'),
+            contact=Contact(email='jan@example.com', phone='123')
+        ),
+        content=Content(
+            invoice_number=7,
+            issue_date=datetime.date(2025, 5, 31),
+            items=[
+                Item(hours=2.5, price=5000, date=datetime.date(2025, 5, 2)),
+                Item(hours=3.0, price=6000, date=datetime.date(2025, 5, 9)),
+            ],
+            note='Danke',
+            year=2025,
+            month=5,
+            vat=vat
+        )
+    )
+
+
+def read_members(content: bytes) -> dict[str, bytes]:
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        assert archive.testzip() is None
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def canonicalize(name: str, content: bytes) -> bytes | dict:
+    if not name.endswith(('.xml', '.rels')):
+        return content
+
+    root = etree.fromstring(content)
+    if name == 'docProps/core.xml':
+        # docxtpl adds empty elements for the properties it renders
+        return {element.tag: element.text for element in root if element.text}
+    return etree.tostring(root, method='c14n', exclusive=True)
+
+
+def render_docxtpl(content: bytes, data: dict) -> bytes:
+    with io.BytesIO() as output:
+        DocxGenerator(data=data, template=io.BytesIO(content)).generate(output)
+        return output.getvalue()
+
+
+class FastDocxTemplateTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.content = create_template()
+
+    def assertSameDocument(self, expected: bytes, actual: bytes):
+        expected, actual = read_members(expected), read_members(actual)
+        self.assertEqual(sorted(expected), sorted(actual))
+        for name in expected:
+            self.assertEqual(
+                canonicalize(name, expected[name]),
+                canonicalize(name, actual[name]),
+                name
+            )
+
+    def test_output_matches_docxtpl(self):
+        for template_class in (CompiledDocxTemplate, FastDocxTemplate):
+            template = template_class(self.content)
+            for vat in (False, True, False):
+                data = create_context(vat=vat).dict()
+                self.assertSameDocument(
+                    render_docxtpl(self.content, data),
+                    template.render_bytes(data)
+                )
+
+    def test_output_matches_docxtpl_generator(self):
+        data = create_context().dict()
+
+        with io.BytesIO() as actual:
+            DocxGenerator(data=data, template=FastDocxTemplate(self.content)).generate(actual)
+            self.assertSameDocument(render_docxtpl(self.content, data), actual.getvalue())
+
+    def test_compiled_template_does_not_reparse_package(self):
+        template = CompiledDocxTemplate(self.content)
+        template.render_bytes(create_context().dict())
+
+        with mock.patch.object(template, 'init_docx', side_effect=AssertionError):
+            template.render_bytes(create_context(vat=True).dict())
+
+    def test_unchanged_members_are_copied(self):
+        output = FastDocxTemplate(self.content).render_bytes(create_context().dict())
+
+        template, rendered = read_members(self.content), read_members(output)
+        for name in ('[Content_Types].xml', 'word/styles.xml', 'word/_rels/document.xml.rels'):
+            self.assertEqual(template[name], rendered[name])
+
+    def test_output_is_deterministic(self):
+        data = create_context().dict()
+        self.assertEqual(
+            FastDocxTemplate(self.content).render_bytes(data),
+            FastDocxTemplate(self.content).render_bytes(data)
+        )
+
+    def test_templated_core_properties_fall_back_to_docxtpl(self):
+        document = Document(io.BytesIO(self.content))
+        document.core_properties.title = 'Rechnung {{ cnt.invoice_number }}'
+        with io.BytesIO() as output:
+            document.save(output)
+            content = output.getvalue()
+
+        data = create_context().dict()
+        fast = FastDocxTemplate(content)
+        rendered = []
+        thread = threading.Thread(
+            target=lambda: rendered.append(fast.render_bytes(data)),
+            daemon=True
+        )
+        thread.start()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+
+        self.assertSameDocument(render_docxtpl(content, data), rendered[0])
+        self.assertIn(b'Rechnung 7', read_members(rendered[0])['docProps/core.xml'])
+
+
+class FakeDriveServer(ThreadingHTTPServer):
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__(('127.0.0.1', 0), FakeDriveHandler)
+        self.delay = delay
+        self.files: dict[str, dict] = {}
+        self.failures: list[int] = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def add(self, name: str, parents: list[str], content: bytes = b'', **metadata) -> dict:
+        file = {
+            'id': uuid.uuid4().hex,
+            'name': name,
+            'parents': parents,
+            'mimeType': 'application/octet-stream',
+            'md5Checksum': hashlib.md5(content).hexdigest(),
+            'appProperties': {},
+            'content': content,
+            **metadata,
+        }
+        self.files[file['id']] = file
+        return file
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def handle_one_request(self):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        try:
+            time.sleep(self.server.delay)
+            super().handle_one_request()
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def _send(self, status: int, body: bytes | dict = b''):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+        else:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _metadata(file: dict) -> dict:
+        return {key: value for key, value in file.items() if key != 'content'}
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _route(self) -> tuple[list[str], dict]:
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        return url.path.strip('/').split('/'), params
+
+    def _fail(self) -> bool:
+        with self.server.lock:
+            status = self.server.failures.pop(0) if self.server.failures else None
+        if status is not None:
+            self._send(status, {'error': {'code': status, 'message': 'Try again'}})
+        return status is not None
+
+    def do_GET(self):
+        if self._fail():
+            return
+        parts, params = self._route()
+        if parts == ['drive', 'v3', 'files']:
+            query = params['q']
+            name = re.search(r"name = '([^']*)'", query)
+            parent = re.search(r"'([^']*)' in parents", query)
+            folders = "mimeType = 'application/vnd.google-apps.folder'" in query
+            files = [
+                self._metadata(file) for file in self.server.files.values()
+                if (not name or file['name'] == name.group(1))
+                and (not parent or parent.group(1) in file['parents'])
+                and (file['mimeType'] == 'application/vnd.google-apps.folder') == folders
+            ]
+            return self._send(200, {'files': files})
+
+        file = self.server.files.get(parts[3])
+        if file is None:
+            return self._send(404, {'error': {'code': 404, 'message': 'File not found'}})
+        if parts[4:] == ['export']:
+            return self._send(200, b'%PDF-1.4 ' + file['content'])
+        if params.get('alt') == 'media':
+            return self._send(200, file['content'])
+        return self._send(200, self._metadata(file))
+
+    def do_POST(self):
+        if self._fail():
+            return
+        parts, params = self._route()
+        body = self._read_body()
+        if parts == ['drive', 'v3', 'files']:
+            metadata = json.loads(body)
+            file = self.server.add(metadata.pop('name'), metadata.pop('parents'), **metadata)
+        elif parts[4:] == ['copy']:
+            source = self.server.files[parts[3]]
+            file = self.server.add(source['name'], ['root'], source['content'], **json.loads(body))
+        else:
+            metadata, content = self._read_multipart(body)
+            file = self.server.add(metadata.pop('name'), metadata.pop('parents'), content, **metadata)
+        return self._send(200, self._metadata(file))
+
+    def do_PATCH(self):
+        if self._fail():
+            return
+        parts, params = self._route()
+        file = self.server.files[parts[4]]
+        metadata, content = self._read_multipart(self._read_body())
+        file.update(metadata, content=content, md5Checksum=hashlib.md5(content).hexdigest())
+        return self._send(200, self._metadata(file))
+
+    def do_DELETE(self):
+        if self._fail():
+            return
+        parts, params = self._route()
+        self.server.files.pop(parts[3], None)
+        return self._send(204)
+
+    def _read_multipart(self, body: bytes) -> tuple[dict, bytes]:
+        message = email.message_from_bytes(
+            f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode() + body
+        )
+        metadata, media = message.get_payload()
+        return json.loads(metadata.get_payload()), media.get_payload(decode=True)
+
+
+@override_settings(
+    GOOGLE_DRIVE_ROOT_FOLDER_ID='root',
+    GOOGLE_DRIVE_BACKOFF_BASE=0.01,
+    GOOGLE_DRIVE_RATE_LIMIT=0
+)
+class AsyncGoogleDriveClientTestCase(SimpleTestCase):
+
+    def run_client(self, server: FakeDriveServer, coro_factory, concurrency: int = 8):
+        async def run():
+            client = AsyncGoogleDriveClient(
+                credentials=AnonymousCredentials(),
+                concurrency=concurrency,
+                base_url=server.url
+            )
+            client.folder_cache.clear()
+            try:
+                return await coro_factory(client)
+            finally:
+                await client.aclose()
+
+        return asyncio.run(run())
+
+    def test_upload_and_convert(self):
+        async def scenario(client: AsyncGoogleDriveClient):
+            folder_id = await client.create_folder_structure('customers/2025/05')
+            await client.index_folder(folder_id)
+
+            file_id, changed = await client.upload_if_changed('a.docx', b'first', folder_id)
+            same_id, unchanged = await client.upload_if_changed('a.docx', b'first', folder_id)
+            updated_id = await client.upload('a.docx', b'second', folder_id)
+            pdf_id = await client.convert_docx_to_pdf(
+                file_id=file_id,
+                filename='a.docx',
+                folder_id=folder_id,
+                cleanup=False,
+                app_properties={'source_md5': 'abc'}
+            )
+            converted = await client.is_converted('a.pdf', folder_id, 'abc')
+            cleanup = await client.cleanup_temporary_files()
+            return (
+                folder_id, file_id, changed, same_id, unchanged, updated_id,
+                pdf_id, converted, cleanup, await client.download(file_id)
+            )
+
+        with FakeDriveServer() as server:
+            (
+                folder_id, file_id, changed, same_id, unchanged, updated_id,
+                pdf_id, converted, cleanup, content
+            ) = self.run_client(server, scenario)
+
+            self.assertEqual(server.files[folder_id]['name'], '05')
+            self.assertTrue(changed)
+            self.assertEqual((same_id, unchanged), (file_id, False))
+            self.assertEqual(updated_id, file_id)
+            self.assertEqual(content, b'second')
+            self.assertEqual(server.files[pdf_id]['content'], b'%PDF-1.4 second')
+            self.assertEqual(server.files[pdf_id]['parents'], [folder_id])
+            self.assertTrue(converted)
+            self.assertTrue(all(result.error is None for result in cleanup.values()))
+            self.assertEqual(len(server.files), 5)
+
+    def test_requests_are_bounded_by_semaphore(self):
+        async def scenario(client: AsyncGoogleDriveClient):
+            await asyncio.gather(*(
+                client.upload(f'{index}.docx', b'content', 'root') for index in range(20)
+            ))
+
+        with FakeDriveServer(delay=0.02) as server:
+            self.run_client(server, scenario, concurrency=5)
+
+            self.assertEqual(len(server.files), 20)
+            self.assertGreater(server.peak, 1)
+            self.assertLessEqual(server.peak, 5)
+
+    def test_retries_throttled_requests(self):
+        async def scenario(client: AsyncGoogleDriveClient):
+            return await client.download(file['id'])
+
+        with FakeDriveServer() as server:
+            file = server.add('a.docx', ['root'], b'content')
+            server.failures = [429, 503]
+            self.assertEqual(self.run_client(server, scenario), b'content')
+
+            server.failures = [404]
+            with self.assertRaises(HttpError):
+                self.run_client(server, scenario)
+
+    def test_failed_creates_are_not_sent_again(self):
+        async def scenario(client: AsyncGoogleDriveClient):
+            return await client.upload('a.docx', b'content', 'root')
+
+        with FakeDriveServer() as server:
+            server.failures = [None, 503]
+            with self.assertRaises(HttpError):
+                self.run_client(server, scenario)
+            self.assertEqual(server.failures, [])
+
+            server.failures = [None, 429]
+            file_id = self.run_client(server, scenario)
+            self.assertEqual(server.files[file_id]['content'], b'content')
+
+    @override_settings(GOOGLE_DRIVE_ASYNC=True, GOOGLE_DRIVE_BACKEND='memory')
+    def test_fake_backend_has_no_async_client(self):
+        with self.assertLogs('invoices.drive', 'WARNING'):
+            self.assertIsNone(get_async_drive_client())
+
+
+@override_settings(GOOGLE_DRIVE_BACKOFF_BASE=0.01)
+class CallWithRetriesTestCase(SimpleTestCase):
+
+    def call(self, errors: list[Exception], idempotent: bool):
+        def func():
+            if errors:
+                raise errors.pop(0)
+            return 'ok'
+        return call_with_retries(func, idempotent=idempotent)
+
+    def http_error(self, status: int) -> HttpError:
+        return HttpError(resp=httplib2.Response({'status': status}), content=b'{}')
+
+    def test_idempotent_calls_are_retried(self):
+        errors = [self.http_error(503), ConnectionResetError(), TimeoutError()]
+        self.assertEqual(self.call(errors, idempotent=True), 'ok')
+
+    def test_non_idempotent_calls_are_retried_only_when_rejected(self):
+        self.assertEqual(self.call([self.http_error(429)], idempotent=False), 'ok')
+        self.assertEqual(self.call([ConnectionRefusedError()], idempotent=False), 'ok')
+
+        for error in (self.http_error(503), ConnectionResetError(), TimeoutError()):
+            with self.assertRaises(type(error)):
+                self.call([error], idempotent=False)
+
+
+class MonthRangeTestCase(SimpleTestCase):
+
+    def test_december_ends_in_the_same_year(self):
+        self.assertEqual(
+            get_month_range(datetime.date(2025, 12, 15)),
+            (datetime.date(2025, 12, 1), datetime.date(2025, 12, 31))
+        )
+
+    def test_month_lengths(self):
+        self.assertEqual(get_month_range(datetime.date(2024, 2, 10))[1], datetime.date(2024, 2, 29))
+        self.assertEqual(get_month_range(datetime.date(2025, 2, 1))[1], datetime.date(2025, 2, 28))
+        self.assertEqual(get_month_range(datetime.date(2025, 4, 30))[1], datetime.date(2025, 4, 30))
+
+
+class ReconcileCustomerInvoicesTestCase(TestCase):
+
+    def test_december_does_not_overwrite_previous_year(self):
+        customer = Customer.objects.create(name='Customer', price=2000)
+        previous = CustomerInvoice.objects.create(
+            customer=customer,
+            year=2024,
+            month=12,
+            data={'cnt': {'invoice_number': 1}}
+        )
+
+        reconcile_customer_invoices(
+            results=[{
+                'invoices': [{
+                    'customer_id': customer.id,
+                    'data': {'cnt': {'invoice_number': 2}},
+                    'fingerprint': 'december',
+                }],
+                'skipped': [],
+                'metrics': {},
+            }],
+            month=datetime.date(2025, 12, 1)
+        )
+
+        previous.refresh_from_db()
+        self.assertEqual(previous.number, 1)
+        invoice = CustomerInvoice.objects.get(customer=customer, year=2025, month=12)
+        self.assertEqual(invoice.number, 2)
+
+
+class ResumeGenerationRunTestCase(TestCase):
+
+    def test_attempt_is_resumed_once(self):
+        customers = [
+            Customer.objects.create(name=f'Customer {index}', price=2000) for index in range(2)
+        ]
+        run = GenerationRunRepository().create(
+            year=2025,
+            month=5,
+            folder_id='folder',
+            incremental=True,
+            invoice_numbers=[[customer.id, 10 + index] for index, customer in enumerate(customers)]
+        )
+        GenerationRunRepository().set_stage(
+            run_id=run.id,
+            customer_ids=[customers[0].id],
+            stage=GenerationRunItem.Stage.PERSISTED
+        )
+
+        with mock.patch('invoices.tasks._schedule_run') as schedule_run:
+            resume_generation_run(run_id=run.id, attempt=1)
+            resume_generation_run(run_id=run.id, attempt=1)
+
+        schedule_run.assert_called_once()
+        self.assertEqual(schedule_run.call_args.kwargs['invoice_numbers'], [[customers[1].id, 11]])
+        run.refresh_from_db()
+        self.assertEqual(run.attempt, 2)
+
+
+backfill_migration = importlib.import_module(
+    'invoices.migrations.0003_backfill_customerinvoice_year_month'
+)
+
+
+class BackfillYearMonthTestCase(TestCase):
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name='Customer', price=2000)
+
+    def create_invoice(self, year: int, month: int, work_date: str) -> CustomerInvoice:
+        return CustomerInvoice.objects.create(
+            customer=self.customer,
+            year=year,
+            month=month,
+            data={'cnt': {
+                'invoice_number': month,
+                'issue_date': '31.12.2025',
+                'items_': [{'date': work_date}],
+            }}
+        )
+
+    def test_year_and_month_follow_work_dates(self):
+        invoice = self.create_invoice(2025, 12, '02.12.2024')
+
+        backfill_migration.backfill_year_month(django_apps, None)
+
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.year, invoice.month), (2024, 12))
+
+    def test_duplicates_abort_the_backfill(self):
+        first = self.create_invoice(2025, 1, '02.12.2024')
+        second = self.create_invoice(2025, 2, '09.12.2024')
+
+        with self.assertRaisesRegex(RuntimeError, f'invoice {first.id} .*invoice {second.id}'):
+            backfill_migration.backfill_year_month(django_apps, None)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.year, first.month), (2025, 1))
+        self.assertEqual((second.year, second.month), (2025, 2))
+        self.assertEqual(CustomerInvoice.objects.count(), 2)
+
+
+class CustomerInvoiceRepositoryTestCase(TestCase):
+
+    def test_upsert_many_updates_the_invoice_of_the_month(self):
+        repo = CustomerInvoiceRepository()
+        customers = [
+            Customer.objects.create(name=f'Customer {index}', price=2000) for index in range(2)
+        ]
+        previous = CustomerInvoice.objects.create(
+            customer=customers[0], year=2025, month=4, data={'cnt': {'invoice_number': 1}}
+        )
+        current = CustomerInvoice.objects.create(
+            customer=customers[0], year=2025, month=5, data={'cnt': {'invoice_number': 2}},
+            fingerprint='old'
+        )
+
+        repo.upsert_many([
+            repo.create_draft(customers[0].id, 2025, 5, {'cnt': {'invoice_number': 3}}, 'new'),
+            repo.create_draft(customers[1].id, 2025, 5, {'cnt': {'invoice_number': 4}}, 'new'),
+        ])
+
+        current.refresh_from_db()
+        self.assertEqual((current.number, current.fingerprint), (3, 'new'))
+        previous.refresh_from_db()
+        self.assertEqual(previous.number, 1)
+        self.assertEqual(
+            repo.get_invoice_numbers(2025, 5, [customer.id for customer in customers]),
+            {customers[0].id: 3, customers[1].id: 4}
+        )
+        self.assertEqual(CustomerInvoice.objects.count(), 3)
+
+
+class RecordingSink(OutputSink):
+
+    def __init__(self):
+        self.documents = []
+        self.pdfs = []
+
+    def open(self, path: str):
+        self.path = path
+
+    def save_document(self, filename: str, content: bytes) -> tuple[str, bool]:
+        self.documents.append(filename)
+        return f'file-{filename}', True
+
+    def save_pdf(self, file_id: str, filename: str, content: bytes) -> str:
+        self.pdfs.append(file_id)
+        return f'pdf-{filename}'
+
+
+class GenerateCustomerInvoicesTestCase(TestCase):
+
+    def setUp(self):
+        temp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        template_path = os.path.join(temp_dir, 'customers.docx')
+        with open(template_path, 'wb') as file:
+            file.write(create_template())
+        self.enterContext(override_settings(INVOICES_LOCAL_TEMPLATE_PATH=template_path))
+
+        Employer.objects.create(name='Jan', data={
+            'company': 'Cleaning',
+            'st_nr': '1',
+            'vat_id': 'DE1',
+            'address': {'street_name': 'Hauptstr. 1', 'zip_code': '10115', 'city': 'Berlin'},
+            'bank_account': {'bank_name': 'Bank', 'iban': 'DE00', 'bic': 'BIC'},
+            'contact': {'email': 'jan@example.com', 'phone': '123'},
+        })
+        self.employee = Employee.objects.create(name='Employee', code='EM')
+        self.customers = []
+        for index in range(3):
+            customer = Customer.objects.create(name=f'Customer {index}', price=2000, data={
+                'name': f'Customer {index}',
+                'note': 'Danke',
+                'address': {'street_name': 'Weg 2', 'zip_code': '10115', 'city': 'Berlin'},
+            })
+            self.add_work(customer, datetime.date(2025, 5, 2))
+            self.customers.append(customer)
+
+    def add_work(self, customer: Customer, date: datetime.date):
+        Work.objects.create(customer=customer, employee=self.employee, hours=2.5, date=date)
+
+    def create_service(self, sink: OutputSink, **kwargs) -> GenerateCustomerInvoicesService:
+        start_date, end_date = get_month_range(datetime.date(2025, 5, 1))
+        return GenerateCustomerInvoicesService(
+            start_date=start_date,
+            end_date=end_date,
+            drive=None,
+            employer_repo=EmployersRepository(),
+            customer_repo=CustomersRepository(),
+            work_repo=WorkRepository(),
+            invoice_repo=CustomerInvoiceRepository(),
+            sink=sink,
+            **kwargs
+        )
+
+    def test_unchanged_invoices_are_skipped(self):
+        numbers = {customer.id: 10 + index for index, customer in enumerate(self.customers)}
+        self.create_service(RecordingSink(), invoice_numbers=numbers, incremental=True).execute()
+
+        sink = RecordingSink()
+        service = self.create_service(sink, invoice_numbers=numbers, incremental=True)
+        self.assertEqual(service.execute(), [])
+        self.assertEqual(service.skipped_customer_ids, list(numbers))
+        self.assertEqual(sink.documents, [])
+
+        self.add_work(self.customers[1], datetime.date(2025, 5, 9))
+        sink = RecordingSink()
+        service = self.create_service(sink, invoice_numbers=numbers, incremental=True)
+        invoices = service.execute()
+        self.assertEqual([invoice.customer_id for invoice in invoices], [self.customers[1].id])
+        self.assertEqual(sink.documents, ['customer_1.docx'])
+
+    def test_resume_continues_from_the_reached_stage(self):
+        run_repo = GenerationRunRepository()
+        numbers = [[customer.id, 10 + index] for index, customer in enumerate(self.customers)]
+        run = run_repo.create(
+            year=2025, month=5, folder_id='folder', incremental=False, invoice_numbers=numbers
+        )
+        persisted, uploaded, pending = (customer.id for customer in self.customers)
+        run_repo.set_stage(run.id, [persisted], GenerationRunItem.Stage.PERSISTED)
+        run_repo.set_stage(run.id, [uploaded], GenerationRunItem.Stage.UPLOADED, file_id='uploaded')
+
+        sink = RecordingSink()
+        service = self.create_service(
+            sink,
+            invoice_numbers=dict(numbers),
+            run_repo=run_repo,
+            run_id=run.id
+        )
+        invoices = service.execute()
+
+        self.assertEqual(service.resumed_customer_ids, [persisted])
+        self.assertEqual([invoice.customer_id for invoice in invoices], [uploaded, pending])
+        self.assertEqual(sink.documents, ['customer_2.docx'])
+        self.assertEqual(sink.pdfs, ['uploaded', 'file-customer_2.docx'])
+        self.assertEqual(
+            set(run.items.values_list('stage', flat=True)),
+            {GenerationRunItem.Stage.PERSISTED}
+        )
+
+
+class SyncDriveMirrorServiceTestCase(TestCase):
+
+    def folder(self, file_id: str, parent_id: str) -> dict:
+        return {'id': file_id, 'name': file_id, 'parents': [parent_id], 'mimeType': FOLDER_MIME_TYPE}
+
+    def file(self, file_id: str, parent_id: str) -> dict:
+        return {'id': file_id, 'name': f'{file_id}.docx', 'parents': [parent_id], 'mimeType': 'text/plain'}
+
+    def test_apply_changes(self):
+        repo = DriveFileRepository()
+        repo.upsert_many([
+            self.folder('moved-out', 'root'),
+            self.file('inside-moved-out', 'moved-out'),
+            self.file('trashed', 'root'),
+            self.file('removed', 'root'),
+            self.file('renamed', 'root'),
+        ])
+        listings = {
+            'created': [self.file('created-child', 'created')],
+            'moved-in': [self.file('moved-in-child', 'moved-in')],
+        }
+        drive = mock.Mock(root_folder_id='root')
+        drive.list_folder.side_effect = lambda folder_id: listings[folder_id]
+
+        service = SyncDriveMirrorService(drive=drive, repo=repo)
+        service.apply_changes([
+            {'fileId': 'moved-out', 'file': self.folder('moved-out', 'elsewhere')},
+            {'fileId': 'trashed', 'file': {**self.file('trashed', 'root'), 'trashed': True}},
+            {'fileId': 'removed', 'removed': True},
+            {'fileId': 'renamed', 'file': {**self.file('renamed', 'root'), 'name': 'new.docx'}},
+            # the child is listed before its folder within the same page
+            {'fileId': 'created-child', 'file': self.file('created-child', 'created')},
+            {'fileId': 'created', 'file': self.folder('created', 'root')},
+            {'fileId': 'moved-in', 'file': self.folder('moved-in', 'created')},
+            {'fileId': 'outside', 'file': self.file('outside', 'elsewhere')},
+        ])
+
+        self.assertEqual(
+            set(DriveFile.objects.values_list('file_id', flat=True)),
+            {'renamed', 'created', 'created-child', 'moved-in', 'moved-in-child'}
+        )
+        self.assertEqual(repo.get_children('root')['new.docx']['id'], 'renamed')
+        self.assertEqual(
+            sorted(call.args[0] for call in drive.list_folder.call_args_list),
+            ['created', 'moved-in']
+        )
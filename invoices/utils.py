@@ -1,3 +1,4 @@
+import datetime
 import functools
 import time
 from typing import Callable
@@ -15,6 +16,16 @@ def timer(func: Callable) -> Callable:
     return wrapper_timer
 
 
+def get_month_range(month: datetime.date) -> tuple[datetime.date, datetime.date]:
+    start_date = month.replace(day=1)
+    # day 32 is always in the following month, also across the year end
+    end_date = (
+        (start_date + datetime.timedelta(days=32)).replace(day=1)
+        - datetime.timedelta(days=1)
+    )
+    return start_date, end_date
+
+
 MONTH_MAPPER = {
     1: "Januar",
     2: "Februar",